@@ -0,0 +1,105 @@
+import asyncio
+import logging
+import random
+import time
+
+STATE_RUNNING     = 'running'      # Started (or starting) normally
+STATE_BACKING_OFF = 'backing-off'  # Failed and waiting before the next attempt
+STATE_OPEN        = 'open'         # Failed repeatedly so attempts are suspended for a while (circuit open)
+STATE_PROBING     = 'probing'      # Checking that the camera can be reached before the next attempt
+
+BASE_DELAY_SECS    = 5     # Delay after the second consecutive failure (the first is retried at once)
+MAX_DELAY_SECS     = 300   # Longest delay between attempts (before the circuit opens)
+JITTER             = 0.2   # Delays vary randomly by up to this fraction (so cameras retry at different times)
+CIRCUIT_FAILURES   = 8     # Consecutive failures that open the circuit
+CIRCUIT_OPEN_SECS  = 900   # Time attempts are suspended for once the circuit is open
+STABLE_SECS        = 120   # Time running after which earlier failures are forgotten
+PROBE_TIMEOUT_SECS = 3
+
+#
+# Exponential backoff with a circuit breaker for restarting something that keeps failing
+# (e.g. a stream from a camera that is offline) so that repeated attempts do not waste
+# resources. Attempts are only made once due and after a probe shows the camera is reachable.
+#
+
+
+class RestartBackoff:
+    def __init__(self, name, base_delay_secs=BASE_DELAY_SECS, max_delay_secs=MAX_DELAY_SECS):
+        self.name = name  # Used when logging
+        self.base_delay_secs = base_delay_secs
+        self.max_delay_secs = max_delay_secs
+        self.state = STATE_RUNNING
+        self.failures = 0            # Consecutive failures
+        self.num_restarts = 0        # Total restarts (after failures)
+        self.num_probe_failures = 0  # Total attempts abandoned as the camera was unreachable
+        self.num_circuit_opens = 0
+        self.next_attempt = 0        # Monotonic time of the next attempt (when not running)
+        self.start_time = time.monotonic()
+
+    def is_running(self):
+        return self.state == STATE_RUNNING
+
+    def is_due(self):
+        return not self.is_running() and time.monotonic() >= self.next_attempt
+
+    def secs_until_due(self):
+        return None if self.is_running() else max(0, self.next_attempt - time.monotonic())
+
+    def on_failure(self):
+        self.failures += 1
+        if self.failures >= CIRCUIT_FAILURES:
+            delay = CIRCUIT_OPEN_SECS
+            self.state = STATE_OPEN
+            self.num_circuit_opens += 1
+            logging.warning(f'#### {self.name} has failed {self.failures} times in a row. '
+                            f'Suspending attempts for {delay}s...')
+        else:
+            delay = self.__get_delay()
+            self.state = STATE_BACKING_OFF
+            if delay > 0:
+                logging.info(f'#### {self.name} has failed {self.failures} times in a row. '
+                             f'Next attempt in {delay:.0f}s...')
+        self.next_attempt = time.monotonic() + delay
+
+    def on_probing(self):
+        self.state = STATE_PROBING
+
+    def on_probe_failure(self):
+        self.num_probe_failures += 1
+        self.on_failure()
+
+    def on_started(self):
+        if self.state != STATE_RUNNING:
+            self.num_restarts += 1
+        self.state = STATE_RUNNING
+        self.start_time = time.monotonic()
+
+    def on_alive(self):
+        # Only forget failures once the restart has proved to be stable
+        if self.is_running() and self.failures and time.monotonic() - self.start_time >= STABLE_SECS:
+            logging.info(f'{self.name} has recovered after {self.failures} failures')
+            self.failures = 0
+
+    def get_status(self):
+        return { 'state'             : self.state,
+                 'failures'          : self.failures,
+                 'restarts'          : self.num_restarts,
+                 'probe_failures'    : self.num_probe_failures,
+                 'circuit_opens'     : self.num_circuit_opens,
+                 'next_attempt_secs' : self.secs_until_due() }
+
+    def __get_delay(self):
+        if self.failures <= 1:
+            return 0
+        delay = min(self.base_delay_secs * 2 ** (self.failures - 2), self.max_delay_secs)
+        return delay * random.uniform(1 - JITTER, 1 + JITTER)
+
+
+# Check that a TCP connection can be made to the given host (without starting a process)
+async def probe(host, port, timeout_secs=PROBE_TIMEOUT_SECS):
+    try:
+        _, writer = await asyncio.wait_for(asyncio.open_connection(host, port), timeout_secs)
+    except (OSError, asyncio.TimeoutError):
+        return False
+    writer.close()
+    return True
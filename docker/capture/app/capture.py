@@ -3,23 +3,60 @@ import argparse
 import os
 import sys
 import signal
-import re
-import glob
 import shutil
-import json
 import logging
 import asyncio
 import time
+import math
+import functools
+import dataclasses
 from onvif import ONVIFCamera
 
 import config
+import backoff
+import executor
+import kill_rec
+import livestore
 import logger
+import playlist
+import probecache
 import process
+import retention
+import seekindex
+import status
 import stream
 import system
+import watcher
 
 ONVIF_DEFS = None
 
+# Time to allow for a camera to reboot before restarting its streams
+REBOOT_WAIT_SECS = 0
+
+# Delays between further attempts to reboot a camera whose streams keep failing
+REBOOT_BACKOFF_BASE_SECS = 300
+REBOOT_BACKOFF_MAX_SECS  = 3600
+
+# Time to allow for all processes to exit on shutdown (e.g. recorders finishing their segments)
+SHUTDOWN_TIMEOUT_SECS = process.TERMINATE_TIMEOUT_SECS
+
+# Time to allow for a killed recording to be replaced by a new one before replying without it
+KILL_REC_TIMEOUT_SECS = 5
+
+# Shortest time between health checks (even when a restart is already due)
+MIN_POLL_SECS = 1
+
+# Time allowed for a batch of streams to produce output on startup before the next batch is started
+STARTUP_BATCH_TIMEOUT_SECS = 15
+
+# Order in which streams are started on startup
+STARTUP_PRIORITY_RECORD    = 0  # Recordings (including the live stream of a combined capture)
+STARTUP_PRIORITY_MAIN_LIVE = 1  # Live streams of the recorded (high resolution) stream
+STARTUP_PRIORITY_LIVE      = 2  # Other live streams (e.g. low resolution streams for the mosaic)
+
+SECS_PER_DAY         = 24 * 60 * 60
+WRITE_RATE_SMOOTHING = 0.2  # Weight of the latest sample in the smoothed write rate
+
 # Camera capture list
 CC_LIST = []
 
@@ -29,72 +66,212 @@ IS_SHUTTING_DOWN = False
 # Lock required to manage any capture process
 PROCESS_LOCK = asyncio.Lock()
 
+# Set to run a health check ahead of the next poll (e.g. when an output stops updating)
+HEALTH_CHECK_EVENT = asyncio.Event()
+
+# Flags that the configuration should be reloaded (e.g. on SIGHUP)
+RELOAD_REQUESTED = False
+
+# Settings that every capture depends on (a configuration changing these is not reloaded)
+RESTART_REQUIRED_KEYS = ('root_path', 'capture_dir', 'segment_length', 'segment_wrap', 'segment_naming',
+                         'time_must_be_dead_secs', 'live_storage', 'live_memory_path')
+
+# Settings only read at startup (changes to these take effect on the next restart)
+STARTUP_ONLY_KEYS = ('logs_dir', 'capture_log', 'log_backup_count', 'log_max_bytes', 'io_threads',
+                     'deletion_queue_size', 'capture_status', 'startup_batch_size')
+
 
 class CameraCapture:
-    def __init__(self, cam, seg_time, seg_wrap, no_update_is_dead_secs):
+    def __init__(self, cam, watcher, seg_time, seg_wrap, no_update_is_dead_secs, segment_listener=None):
+        self.watcher                = watcher
+        self.seg_time               = seg_time
+        self.seg_wrap               = seg_wrap
+        self.no_update_is_dead_secs = no_update_is_dead_secs
+        self.segment_listener       = segment_listener
+        # Required for rebooting the camera
+        self.rebooting              = False
+        self.reboot_time            = 0
+
+        self.configure(cam)
+        self.reboots = backoff.RestartBackoff(f'Rebooting {self.name}', REBOOT_BACKOFF_BASE_SECS,
+                                              REBOOT_BACKOFF_MAX_SECS)
+        self.record_stream = self.__create_record_stream(cam.streams[0])
+        self.live_streams = [self.__create_live_stream(s) for s in self.__get_live_stream_configs(cam)]
+
+    def configure(self, cam):
+        self.cam               = cam
         self.name              = cam.name
         self.ip                = cam.ip
         self.onvif_port        = cam.onvif_port
         self.username          = cam.username
         self.password          = cam.password
         self.reboot_on_failure = cam.reboot_on_failure
-        # Required for rebooting the camera
-        self.rebooting         = False
-
-        self.live_streams = []  # Stores all live stream captures
-        for idx, s in enumerate(cam.streams):
-            if idx == 0:  # Record only the first stream
-                self.record_stream = stream.RecordStreamCapture(cam, s, seg_time, seg_wrap, no_update_is_dead_secs)
-            self.live_streams.append(stream.LiveStreamCapture(cam, s, no_update_is_dead_secs))
-
-    def health_check(self):
-        if not self.reboot_on_failure:
-            self.health_check_standard()
-        else:
-            self.health_check_reboot_on_failure()
-
-    def health_check_standard(self):
-        if not self.record_stream.is_alive():
-            logging.info(f'#### Recording from {self.record_stream.name} is dead. Restarting...')
-            self.record_stream.restart()
+        self.capture_mode      = cam.capture_mode
+
+    def __create_record_stream(self, s):
+        # Record only the first stream (restarting the recording as soon as its process exits)
+        if self.capture_mode == config.CAPTURE_MODE_COMBINED:
+            # Record and live stream the first stream from a single ingest
+            return stream.CombinedStreamCapture(self.cam, s, self.watcher, self.seg_time, self.seg_wrap,
+                                                self.no_update_is_dead_secs, self.segment_listener,
+                                                on_stream_restart)
+        return stream.RecordStreamCapture(self.cam, s, self.watcher, self.seg_time, self.seg_wrap,
+                                          self.no_update_is_dead_secs, self.segment_listener, on_stream_restart)
+
+    def __create_live_stream(self, s):
+        return stream.LiveStreamCapture(self.cam, s, self.watcher, self.no_update_is_dead_secs)
+
+    def __get_live_stream_configs(self, cam):
+        # The first stream is live streamed by the recording process in combined capture mode
+        if cam.capture_mode == config.CAPTURE_MODE_COMBINED:
+            return cam.streams[1:]
+        return cam.streams
+
+    def get_captures(self):
+        return [self.record_stream] + self.live_streams
+
+    async def start(self):
+        for capture in self.get_captures():
+            await capture.start()
+
+    async def stop(self):
+        for capture in self.get_captures():
+            await capture.stop()
+
+    # Apply a changed configuration for this camera, only restarting the streams whose
+    # configuration has changed. Returns the number of streams restarted.
+    async def update(self, cam):
+        old_cam = self.cam
+        self.configure(cam)  # Settings that do not affect the streams (e.g. rebooting) just take effect
+        record_changed = cam.capture_mode != old_cam.capture_mode or \
+                         cam.record_container != old_cam.record_container or cam.streams[0] != old_cam.streams[0]
+        live_configs = {s.name : s for s in self.__get_live_stream_configs(cam)}
+
+        # Stop the old captures first as a replacement capture writes to the same directory
+        num_restarted = 0
+        if record_changed:
+            logging.info(f'#### Configuration changed: stopping {self.record_stream.describe()}')
+            await self.record_stream.stop()
+        kept = {}
         for capture in self.live_streams:
-            if not capture.is_alive():
-                logging.info(f'#### Live streaming from {capture.name} [stream:{capture.stream.name}] is dead. Restarting...')
-                capture.restart()
+            if live_configs.get(capture.stream.name) == capture.stream:
+                kept[capture.stream.name] = capture
+                continue
+            logging.info(f'#### Configuration changed: stopping {capture.describe()}')
+            await capture.stop()
+
+        if record_changed:
+            self.record_stream = self.__create_record_stream(cam.streams[0])
+            await self.record_stream.start()
+            num_restarted += 1
+        live_streams = []
+        for name, s in live_configs.items():
+            capture = kept.get(name)
+            if capture is None:
+                capture = self.__create_live_stream(s)
+                await capture.start()
+                num_restarted += 1
+            live_streams.append(capture)
+        self.live_streams = live_streams
+        return num_restarted
+
+    # Rebooting needs the ONVIF port of the camera (streams are restarted as usual without it)
+    def can_reboot(self):
+        return self.reboot_on_failure and self.onvif_port is not None
+
+    async def health_check(self):
+        if not self.can_reboot():
+            await self.health_check_standard()
+        else:
+            await self.health_check_reboot_on_failure()
 
-    def health_check_reboot_on_failure(self):
+    async def health_check_standard(self):
+        for capture in self.get_captures():
+            if capture.is_alive():
+                capture.restarts.on_alive()
+                continue
+            if capture.restarts.is_running():
+                logging.info(f'#### {capture.describe()} is dead.')
+                await capture.fail()
+            # Only restarted once its backoff allows (and the camera can be reached)
+            await capture.restart_if_due()
+        await self.check_combined_live_output()
+
+    async def health_check_reboot_on_failure(self):
         if self.rebooting:
-            self.restart_all_streams_after_reboot()  # Assume the reboot is complete
-        else:
-            attempt_reboot = False
-            if not self.record_stream.is_alive():
-                logging.info(f'#### Recording from {self.record_stream.name} is dead.')
-                attempt_reboot = True
-            for capture in self.live_streams:
-                if not capture.is_alive():
-                    logging.info(f'#### Live streaming from {capture.name} [stream:{capture.stream.name}] is dead.')
-                    attempt_reboot = True
-            if attempt_reboot:
-                self.reboot()
-
-    def restart_all_streams_after_reboot(self):
-        logging.info(f'#### Restarting recording from {self.record_stream.name}...')
-        self.record_stream.restart()
-        for capture in self.live_streams:
-            logging.info(f'#### Restarting live streaming from {capture.name} [stream:{capture.stream.name}]...')
-            capture.restart()
-        self.rebooting = False
+            if time.monotonic() - self.reboot_time < REBOOT_WAIT_SECS:
+                return
+            await self.restart_all_streams_after_reboot()  # Assume the reboot is complete
+            return
 
-    def reboot(self):
-        if not self.onvif_port or not self.reboot_on_failure:
+        dead = [capture for capture in self.get_captures() if not capture.is_alive()]
+        if not dead:
+            self.reboots.on_alive()
+            await self.check_combined_live_output()
+            return
+        if self.reboots.is_running():
+            for capture in dead:
+                logging.info(f'#### {capture.describe()} is dead.')
+            self.reboots.on_failure()
+        # Rebooting again straight away is unlikely to help if the last reboot did not
+        if self.reboots.is_due():
+            await self.reboot()
+
+    async def restart_all_streams_after_reboot(self):
+        self.rebooting = False
+        if not await backoff.probe(self.ip, self.cam.port):
+            logging.info(f'#### {self.name} is unreachable after rebooting ({self.ip}:{self.cam.port})')
+            self.reboots.on_probe_failure()
+            return
+        for capture in self.get_captures():
+            logging.info(f'#### Restarting: {capture.describe()}...')
+            await capture.restart()
+            capture.restarts.on_started()
+        self.reboots.on_started()
+
+    async def check_combined_live_output(self):
+        # A failed live output does not stop the shared recording so is replaced separately
+        if self.capture_mode == config.CAPTURE_MODE_COMBINED and self.record_stream.is_alive() and \
+           not self.record_stream.is_live_alive():
+            await self.record_stream.start_live_fallback()
+
+    # Time until the next attempt to restart a failed stream (or reboot) is due (None if none is pending)
+    def get_secs_until_due(self):
+        delays = [capture.restarts.secs_until_due() for capture in self.get_captures()]
+        if self.rebooting:
+            delays.append(max(0, self.reboot_time + REBOOT_WAIT_SECS - time.monotonic()))
+        elif self.can_reboot():
+            delays.append(self.reboots.secs_until_due())
+        delays = [delay for delay in delays if delay is not None]
+        return min(delays) if delays else None
+
+    def get_status(self):
+        return { 'rebooting' : self.rebooting,
+                 'reboots'   : self.reboots.get_status() if self.can_reboot() else None,
+                 'streams'   : [{ 'description'               : capture.describe(),
+                                  'trimmed_probe'             : capture.probe_params is not None,
+                                  'time_to_first_output_secs' : capture.time_to_first_output,
+                                  'startup_secs'              : capture.startup_secs,
+                                  **capture.restarts.get_status() }
+                                for capture in self.get_captures()] }
+
+    async def reboot(self):
+        if not self.can_reboot():
             return
 
         try:
-            cam = ONVIFCamera(self.ip, self.onvif_port, self.username, self.password, ONVIF_DEFS)
-            logging.info(f'######## Rebooting {self.ip} : {cam.devicemgmt.SystemReboot()}')
+            # Parsing the WSDL and making the SOAP call are both blocking
+            result = await executor.run_io(self.__send_reboot)
+            logging.info(f'######## Rebooting {self.ip} : {result}')
             self.rebooting = True
+            self.reboot_time = time.monotonic()
         except Exception:
             logging.exception(f'Failed to reboot {self.ip}')
+            self.reboots.on_failure()
+
+    def __send_reboot(self):
+        cam = ONVIFCamera(self.ip, self.onvif_port, self.username, self.password, ONVIF_DEFS)
+        return cam.devicemgmt.SystemReboot()
 
     def get_live_streams(self):
         return self.live_streams
@@ -102,160 +279,523 @@ class CameraCapture:
     def get_record_stream(self):
         return self.record_stream
 
+    def get_startup_priority(self, capture):
+        if capture is self.record_stream:
+            return STARTUP_PRIORITY_RECORD
+        if capture.stream == self.cam.streams[0]:
+            return STARTUP_PRIORITY_MAIN_LIVE
+        return STARTUP_PRIORITY_LIVE
+
 
 class CheckDiskUsage:
-    def __init__(self, cfg):
-        self.cfg = cfg
-        self.capture_path = os.path.join(cfg.root_path, cfg.capture_dir)
-
-        while self.__is_usage_exceeded():
-            oldest_file = self.__get_oldest_cam_file()
-            if oldest_file:
-                logging.info(f'#### Deleting oldest recording: {os.path.basename(oldest_file)}')
-                os.remove(oldest_file)
-            else:  # Sanity check
-                break
+    def __init__(self, cfg, index, deletion_worker):
+        self.index = index
+        self.deletion_worker = deletion_worker
+        self.capture_path = cfg.capture_path
+        self.configure(cfg)
+
+        self.pending_bytes = 0     # Queued for deletion but not yet deleted
+        self.freed_bytes   = 0     # Deleted since free disk space was last sampled
+        self.last_sample   = None  # Time and free disk space when last sampled
+        self.write_rate    = None  # Smoothed aggregate write rate of all recorders (bytes per second)
+
+    def configure(self, cfg):
+        # Each camera is entitled to a share of the recordings proportional to its weight
+        self.weights = {}
+        self.min_retention_secs = {}
+        for cam in cfg.cameras:
+            self.weights[cam.name] = cam.retention_weight
+            self.min_retention_secs[cam.name] = cam.min_retention_days * SECS_PER_DAY
+
+        # Free space is kept between the minimum and the target (i.e. high and low watermarks)
+        self.min_free_percent = cfg.min_free_disk_percent
+        self.target_free_percent = cfg.target_free_disk_percent
+        self.sweep_ahead_secs = cfg.sweep_ahead_secs
+
+    async def run(self):
+        total, free = await executor.run_io(self.__get_disk_usage)
+        self.__update_write_rate(free)
+        free += self.pending_bytes  # Space that will soon be free
+
+        min_free = total * self.min_free_percent / 100
+        secs_to_full = (free - min_free) / self.write_rate if self.write_rate else None
+        logging.debug(f'Disk usage: free={free / (1024 ** 3):.1f} GB, '
+                      f'write rate={(self.write_rate or 0) / (1024 ** 2):.2f} MB/s, '
+                      f'time to minimum free space={"unknown" if secs_to_full is None else f"{secs_to_full:.0f}s"}')
+
+        if free < min_free:
+            reason = 'Free disk space is below the minimum'
+        elif secs_to_full is not None and secs_to_full < self.sweep_ahead_secs:
+            reason = f'Free disk space will fall below the minimum in {secs_to_full:.0f}s'
+        else:
+            return
+        # Free enough that another sweep will not be due again straight away
+        target_free = max(total * self.target_free_percent / 100,
+                          min_free + 2 * (self.write_rate or 0) * self.sweep_ahead_secs)
+        self.__sweep(target_free - free, reason)
 
     def __get_disk_usage(self):
         usage = shutil.disk_usage(self.capture_path)
         return usage.total, usage.free
 
-    def __is_usage_exceeded(self):
-        total, free = self.__get_disk_usage()
-        return True if (int((free / total) * 100) < self.cfg.min_free_disk_percent) else False
-
-    def __get_oldest_cam_file(self):
-        oldest_mtime = None
-        oldest_file = None
-
-        for cam in self.cfg.cameras:
-            cam_dir = os.path.join(self.capture_path, cam.name)
-
-            files = [os.path.join(cam_dir, f) for f in os.listdir(cam_dir) if re.match('.*\.mp4$', f, re.IGNORECASE)]
-            files.sort(key=lambda x: os.path.getmtime(x))
-
-            if len(files) == 0:
-                continue
-
-            oldest_cam_file = files[0]
-            oldest_cam_mtime = os.path.getmtime(oldest_cam_file)
+    def __update_write_rate(self, free):
+        now = time.monotonic()
+        if self.last_sample is not None:
+            last_time, last_free = self.last_sample
+            # Any space freed by deletions since the last sample has also been written to
+            written = last_free - free + self.freed_bytes
+            if now > last_time:
+                rate = max(0, written / (now - last_time))
+                self.write_rate = rate if self.write_rate is None else \
+                                  WRITE_RATE_SMOOTHING * rate + (1 - WRITE_RATE_SMOOTHING) * self.write_rate
+        self.last_sample = (now, free)
+        self.freed_bytes = 0
+
+    def __sweep(self, bytes_to_free, reason):
+        # Queue a batch of deletions in one go without waiting (the deletion worker removes them
+        # in the background). Once the queue is full, the rest are left to the next check, which
+        # counts the space still to be freed by those queued.
+        num_deleted, bytes_queued = 0, 0
+        while bytes_queued < bytes_to_free:
+            if self.deletion_worker.is_full():
+                logging.info(f'Deletion queue is full ({self.deletion_worker.num_pending()} recordings). '
+                             'Deleting more on the next check.')
+                break
+            cam_name = self.__get_cam_most_usage()
+            if cam_name is None:  # Sanity check
+                break
+            bytes_queued += self.__delete_oldest_rec(cam_name)
+            num_deleted += 1
+        if num_deleted == 0 and not self.deletion_worker.is_full():
+            logging.warning(f'#### {reason}. No recordings can be deleted.')
+        elif num_deleted > 0:
+            logging.info(f'#### {reason}. Deleting {num_deleted} recordings ({bytes_queued / (1024 ** 3):.2f} GB)')
+
+    # Recordings queued for deletion but not yet deleted
+    def get_status(self):
+        return { 'pending_deletions'      : self.deletion_worker.num_pending(),
+                 'pending_deletion_bytes' : self.pending_bytes }
+
+    def __on_deleted(self, size, future):
+        self.pending_bytes -= size
+        if future.result():
+            self.freed_bytes += size
 
-            if not oldest_mtime or oldest_cam_mtime < oldest_mtime:
-                oldest_mtime = oldest_cam_mtime
-                oldest_file = oldest_cam_file
+    def __get_cam_most_usage(self):
+        cam_most_usage = self.__get_cam_furthest_over_share(respect_min_retention=True)
+        if cam_most_usage is None:
+            cam_most_usage = self.__get_cam_furthest_over_share(respect_min_retention=False)
+            if cam_most_usage is not None:
+                logging.warning(f'All recordings are within their minimum retention period. '
+                                f'Deleting from {cam_most_usage} anyway.')
+        return cam_most_usage
 
-        return oldest_file
+    def __get_cam_furthest_over_share(self, respect_min_retention):
+        # Only cameras with recordings take a share of the space used (and the most recent
+        # recording of each camera is never deleted as it may still be being written)
+        cams = [cam for cam in self.weights if self.index.num_segments(cam) > 1]
+        total_weight = sum(self.weights[cam] for cam in cams)
+        max_usage = self.index.get_usage()
+        now = time.time()
 
-    def __get_cam_most_usage(self):
-        max_percent_over = 0
+        max_percent_over = None
         cam_most_usage = None
-
-        for cam in self.cam_usage:
-            current = self.cam_usage[cam]['total']
-            expected = (self.cam_usage[cam]['average'] / self.total_average_rec_size) * self.max_usage
-            if current < expected:
+        for cam in cams:
+            if respect_min_retention and \
+               now - self.index.oldest_for_camera(cam).key < self.min_retention_secs[cam]:
                 continue
-            percent_over = ((current - expected) / expected) * 100
-            if percent_over < max_percent_over:
+            current = self.index.get_usage(cam)
+            expected = (self.weights[cam] / total_weight) * max_usage if total_weight else 0
+            percent_over = ((current - expected) / expected) * 100 if expected else math.inf
+            if max_percent_over is not None and percent_over <= max_percent_over:
                 continue
             max_percent_over = percent_over
             cam_most_usage = cam
         return cam_most_usage
 
     def __delete_oldest_rec(self, cam_name):
-        files = sorted(glob.glob(os.path.join(self.capture_path, cam_name, '*.mp4')), key=os.path.getmtime)
-        logging.info(f'#### Deleting oldest recording: {os.path.basename(files[0])}')
-        os.remove(files[0])
+        oldest = self.index.oldest_for_camera(cam_name)
+        logging.info(f'#### Deleting oldest recording: {oldest.filename} '
+                     f'[{cam_name} usage: {self.index.get_usage(cam_name) / (1024 ** 3):.1f} GB]')
+        self.index.remove_segment(cam_name, oldest.filename)
+        self.pending_bytes += oldest.size
+        future = self.deletion_worker.submit(self.index.get_path(oldest))
+        future.add_done_callback(functools.partial(self.__on_deleted, oldest.size))
+        return oldest.size
+
+
+class ReloadConfig:
+    def __init__(self, config_file, cfg, watcher, index, disk_usage):
+        self.config_file = config_file
+        self.cfg = cfg
+        self.watcher = watcher
+        self.index = index
+        self.disk_usage = disk_usage
+        self.file_state = self.__get_file_state()
+
+    # Reload the configuration if requested or the file has changed since it was last loaded
+    async def run(self):
+        global RELOAD_REQUESTED
+
+        file_state = await executor.run_io(self.__get_file_state)
+        if not RELOAD_REQUESTED and file_state == self.file_state:
+            return
+        RELOAD_REQUESTED, self.file_state = False, file_state
+
+        try:
+            cfg = await executor.run_io(config.load, self.config_file)
+        except config.ConfigError as e:
+            logging.error(f'#### Configuration not reloaded: {e}')
+            return
+        if cfg == self.cfg:
+            return
+
+        changed = [f.name for f in dataclasses.fields(cfg)
+                   if not f.metadata.get('derived') and getattr(cfg, f.name) != getattr(self.cfg, f.name)]
+        restart_required = [key for key in changed if key in RESTART_REQUIRED_KEYS]
+        if restart_required:
+            logging.error(f'#### Configuration not reloaded: changing {", ".join(restart_required)} '
+                          'requires a restart')
+            return
+        startup_only = [key for key in changed if key in STARTUP_ONLY_KEYS]
+        if startup_only:
+            logging.warning(f'Changes to {", ".join(startup_only)} take effect on the next restart')
+
+        logging.info('#### Reloading configuration...')
+        async with PROCESS_LOCK:
+            if IS_SHUTTING_DOWN:
+                return
+            await self.__update_cameras(cfg)
+        self.__apply_settings(cfg)
+        self.cfg = cfg
+
+    def __get_file_state(self):
+        try:
+            stat_info = os.stat(self.config_file)
+        except OSError:
+            return None
+        return stat_info.st_ino, stat_info.st_mtime_ns, stat_info.st_size
+
+    async def __update_cameras(self, cfg):
+        cameras = {cc.name : cc for cc in CC_LIST}
+        num_added, num_removed, num_restarted = 0, 0, 0
+
+        for cc in CC_LIST:
+            if cfg.get_camera(cc.name) is None:
+                logging.info(f'#### Camera removed: {cc.name}')
+                await cc.stop()
+                self.index.remove_camera(cc.name)
+                num_removed += 1
+
+        captures = []
+        for cam in cfg.cameras:
+            cc = cameras.get(cam.name)
+            if cc is None:
+                logging.info(f'#### Camera added: {cam.name}')
+                entries = await executor.run_io(self.index.scan_camera, cam)
+                self.index.add_camera(cam.name, entries)
+                cc = CameraCapture(cam, self.watcher, cfg.segment_length, cfg.segment_wrap,
+                                   cfg.time_must_be_dead_secs, self.index)
+                await cc.start()
+                num_added += 1
+            elif cam != cc.cam:
+                num_restarted += await cc.update(cam)
+            captures.append(cc)
+        CC_LIST[:] = captures
+
+        logging.info(f'Configuration reloaded: {num_added} cameras added, {num_removed} cameras removed, '
+                     f'{num_restarted} streams restarted')
+
+    def __apply_settings(self, cfg):
+        global ONVIF_DEFS
+        global REBOOT_WAIT_SECS
+        global SHUTDOWN_TIMEOUT_SECS
+
+        ONVIF_DEFS = cfg.onvif_wsdl_defs
+        REBOOT_WAIT_SECS = cfg.health_poll_secs
+        SHUTDOWN_TIMEOUT_SECS = cfg.shutdown_timeout_secs
+        self.disk_usage.configure(cfg)
+
+
+def request_reload():
+    global RELOAD_REQUESTED
+
+    logging.info('[SIGHUP] Reload requested')
+    RELOAD_REQUESTED = True
+    HEALTH_CHECK_EVENT.set()
+
+
+# Start every stream in batches (in priority order) rather than all at once so that the
+# CPU and network are not swamped by every process probing its stream at the same time
+async def start_captures(batch_size):
+    start_time = time.monotonic()
+    captures = [(cc.get_startup_priority(capture), capture) for cc in CC_LIST for capture in cc.get_captures()]
+    captures = [capture for _, capture in sorted(captures, key=lambda item: item[0])]  # Cameras stay in order
+    logging.info(f'Starting {len(captures)} streams in batches of {batch_size}...')
+
+    num_producing = 0
+    for i in range(0, len(captures), batch_size):
+        batch = captures[i:i + batch_size]
+        batch_start_secs = time.monotonic() - start_time
+        async with PROCESS_LOCK:
+            if IS_SHUTTING_DOWN:
+                return
+            for capture in batch:
+                await capture.start()
+
+        # Only start the next batch once this one is producing output (or has had long enough to)
+        await asyncio.wait([capture.first_output for capture in batch], timeout=STARTUP_BATCH_TIMEOUT_SECS)
+        if IS_SHUTTING_DOWN:
+            return
+        for capture in batch:
+            if capture.first_output.done() and capture.first_output.result():
+                capture.startup_secs = batch_start_secs + capture.time_to_first_output
+                num_producing += 1
+            else:
+                logging.warning(f'{capture.describe()}: no output on startup')
+    logging.info(f'Started {len(captures)} streams in {time.monotonic() - start_time:.1f}s '
+                 f'({num_producing} producing output)')
 
 
 async def health_check():
     async with PROCESS_LOCK:
         if IS_SHUTTING_DOWN:
             return
-        for cc in CC_LIST:
-            cc.health_check()
+        # Cameras are checked at once so that probing an unreachable camera does not hold up the others
+        await asyncio.gather(*(cc.health_check() for cc in CC_LIST))
+
+
+# Time until the next attempt to restart a failed stream is due (None if none is pending)
+def get_secs_until_due():
+    delays = [cc.get_secs_until_due() for cc in CC_LIST]
+    delays = [delay for delay in delays if delay is not None]
+    return min(delays) if delays else None
+
+
+# Check the memory used by live output (when kept in memory). Returns its usage.
+async def check_live_storage():
+    live_dirs = [s.live_dir for cc in CC_LIST for s in cc.cam.streams]
+    usage = await executor.run_io(livestore.get_usage, live_dirs)
+    if usage is None:
+        return None
+    total, free, sizes = usage
+    if free < total * livestore.LOW_FREE_PERCENT / 100:
+        logging.warning(f'#### Memory for live output is running out: {free / (1024 ** 2):.1f} MB free '
+                        f'of {total / (1024 ** 2):.0f} MB in {livestore.MEMORY_PATH}')
+    return { 'path'        : livestore.MEMORY_PATH,
+             'total_bytes' : total,
+             'free_bytes'  : free,
+             'streams'     : sizes }
 
 
-async def capture_from_cameras(cfg):
+# Measure the delay of the live output of every stream from its playlist
+async def check_live_delay():
+    streams = [s for cc in CC_LIST for s in cc.cam.streams]
+    return await executor.run_io(playlist.get_delays, streams)
+
+
+async def write_status(status_file, live_storage, live_delay, disk_usage):
+    try:
+        await executor.run_io(status.write, status_file, {cc.name : cc.get_status() for cc in CC_LIST},
+                              live_storage, live_delay, disk_usage)
+    except OSError as e:
+        logging.warning(f'Unable to write status: {e}')
+
+
+async def capture_from_cameras(config_file, cfg):
     global ONVIF_DEFS
+    global REBOOT_WAIT_SECS
+    global SHUTDOWN_TIMEOUT_SECS
     global CC_LIST
 
     ONVIF_DEFS = cfg.onvif_wsdl_defs
+    REBOOT_WAIT_SECS = cfg.health_poll_secs
+    SHUTDOWN_TIMEOUT_SECS = cfg.shutdown_timeout_secs
 
     logging.info('Starting capture...')
 
-    capture_dir = os.path.join(cfg.root_path, cfg.capture_dir)
+    capture_dir = cfg.capture_path
     if not os.path.exists(capture_dir):
         os.mkdir(capture_dir)
     os.chdir(capture_dir)
 
-    for c in cfg.cameras:
-        CC_LIST.append(CameraCapture(c, cfg.segment_length, cfg.segment_wrap, cfg.time_must_be_dead_secs))
+    # All blocking filesystem work is done off the event loop
+    executor.configure(cfg.io_threads)
+    loop_lag = executor.LoopLagMonitor()
 
-    while True:
-        await asyncio.sleep(cfg.health_poll_secs)
-        await health_check()
-        CheckDiskUsage(cfg)
+    # Built once at startup and kept up to date as recordings are created and deleted
+    index = await executor.run_io(retention.RetentionIndex, capture_dir, cfg.cameras)
+    await executor.run_io(probecache.configure, capture_dir)
+    await executor.run_io(livestore.configure, cfg)
+    deletion_worker = executor.DeletionWorker(cfg.deletion_queue_size, (seekindex.SIDECAR_EXT,))
+    disk_usage = CheckDiskUsage(cfg, index, deletion_worker)
 
+    # Tracks the current output of every stream (waking the health check as soon as one stops updating)
+    output_watcher = watcher.SegmentWatcher(on_stale=lambda state: HEALTH_CHECK_EVENT.set())
+    output_watcher.start()
 
-async def sigterm_handler():
+    reload_config = ReloadConfig(config_file, cfg, output_watcher, index, disk_usage)
+
+    for c in cfg.cameras:
+        cc = CameraCapture(c, output_watcher, cfg.segment_length, cfg.segment_wrap, cfg.time_must_be_dead_secs,
+                           index)
+        CC_LIST.append(cc)
+    await start_captures(cfg.startup_batch_size)
+
+    kill_rec_server = kill_rec.KillRecServer(kill_recordings)
+    await kill_rec_server.start()
+
+    try:
+        while True:
+            # Wake early when a failed stream is due to be restarted
+            poll_secs = reload_config.cfg.health_poll_secs
+            secs_until_due = get_secs_until_due()
+            if secs_until_due is not None:
+                poll_secs = max(min(poll_secs, secs_until_due), MIN_POLL_SECS)
+            try:
+                await asyncio.wait_for(HEALTH_CHECK_EVENT.wait(), poll_secs)
+            except asyncio.TimeoutError:
+                pass
+            HEALTH_CHECK_EVENT.clear()
+            await reload_config.run()
+            await health_check()
+            await write_status(cfg.capture_status_file, await check_live_storage(), await check_live_delay(),
+                               disk_usage.get_status())
+            await disk_usage.run()
+            loop_lag.log_and_reset()
+    finally:
+        await kill_rec_server.close()
+
+
+async def sigterm_handler(main_task):
     global IS_SHUTTING_DOWN
 
+    if IS_SHUTTING_DOWN:
+        return  # Already shutting down
+
     async with PROCESS_LOCK:
-        logging.info('[SIGTERM] Shutting down')
+        logging.info(f'[SIGTERM] Shutting down (allowing {SHUTDOWN_TIMEOUT_SECS}s for recordings to be closed)')
         IS_SHUTTING_DOWN = True
-        for camera in CC_LIST:
-            logging.info(f'Killing streams for camera: {camera.name}')
-            for idx, live_stream in enumerate(camera.get_live_streams()):
-                label = 'high def' if idx == 0 else 'low def'
-                logging.info(f'-> {label} live stream')
-                live_stream.kill()
-            rec_stream = camera.get_record_stream()
-            if rec_stream:
-                logging.info('-> record stream')
-                rec_stream.kill()
-
-
-async def sigchld_handler():
+        start_time = time.monotonic()
+
+        # Ask every process to exit at once so that all recorders finish their segments in parallel
+        # (only those still running when the time allowed is up are killed)
+        captures = [capture for camera in CC_LIST for capture in camera.get_captures()]
+        results = await asyncio.gather(*(shutdown_capture(capture) for capture in captures))
+
+        num_closed = sum(1 for result in results if result is True)
+        num_abandoned = sum(1 for result in results if result is False)
+        logging.info(f'Shutdown complete in {time.monotonic() - start_time:.1f}s: '
+                     f'{num_closed} recordings closed cleanly, {num_abandoned} abandoned')
+    main_task.cancel()
+
+
+# Stop a capture on shutdown. Returns True if its recording was closed cleanly, False if
+# it was abandoned (its process had to be killed) or None if it is not a running recorder.
+async def shutdown_capture(capture):
+    proc = capture.capture_proc
+    if proc is None or not proc.is_alive():
+        await capture.kill()
+        return None
+    segment = capture.watch.current
+    await capture.kill(SHUTDOWN_TIMEOUT_SECS)
+
+    if not isinstance(capture, stream.RecordStreamCapture) or segment is None:
+        return None
+    if proc.is_force_killed:
+        logging.warning(f'{capture.describe()}: abandoned {segment} '
+                        f'(still running after {SHUTDOWN_TIMEOUT_SECS}s)')
+        return False
+    logging.info(f'{capture.describe()}: closed {segment} [exit code: {proc.exited.result()}]')
+    return True
+
+
+# Kill the current recording of each of the given cameras (all at once), returning the
+# status of each and the new recording it has started (see kill_rec)
+async def kill_recordings(client_id, camera_names):
+    cameras = {cc.name : cc for cc in CC_LIST}
+    results = {}
+    captures = []
+    for name in camera_names:
+        if name not in cameras:
+            logging.warning(f'[{client_id}] Unknown camera: {name}')
+            results[name] = (kill_rec.STATUS_UNKNOWN, None)
+            continue
+        record_stream = cameras[name].get_record_stream()
+        if not record_stream.restarts.is_running():
+            logging.warning(f'[{client_id}] Not recording from {name} ({record_stream.restarts.state})')
+            results[name] = (kill_rec.STATUS_UNAVAILABLE, None)
+            continue
+        logging.info(f'[{client_id}] Kill recording: {name}')
+        captures.append(record_stream)
+    if not captures:
+        return results
+
     async with PROCESS_LOCK:
         if IS_SHUTTING_DOWN:
-            return  # Ignore if we are shutting down
+            return results | {capture.name : (kill_rec.STATUS_UNAVAILABLE, None) for capture in captures}
+        # Wait for the segments created after the restarts (not any created while restarting others)
+        next_segments = [capture.get_next_segment() for capture in captures]
+        await asyncio.gather(*(capture.restart() for capture in captures))
+
+    done, pending = await asyncio.wait(next_segments, timeout=KILL_REC_TIMEOUT_SECS)
+    for capture, next_segment in zip(captures, next_segments):
+        if next_segment in done:
+            results[capture.name] = (kill_rec.STATUS_OK, next_segment.result())
+        else:
+            next_segment.cancel()
+            logging.warning(f'[{client_id}] No new recording from {capture.name} after {KILL_REC_TIMEOUT_SECS}s')
+            results[capture.name] = (kill_rec.STATUS_TIMEOUT, None)
+    return results
+
+
+def on_stream_restart(capture, proc):
+    asyncio.create_task(restart_stream(capture, proc))
+
 
-        logging.info('[SIGCHLD] Checking for killed recordings')
+async def restart_stream(capture, proc):
+    async with PROCESS_LOCK:
+        if IS_SHUTTING_DOWN:
+            return  # Ignore if we are shutting down
+        if capture.capture_proc is not proc:
+            return  # Already restarted
 
-        for camera in CC_LIST:
-            rec_stream = camera.get_record_stream()
-            if rec_stream and not rec_stream.is_alive():
-                logging.info(f'Recording killed for {camera.name} (restarting)')
-                rec_stream.restart()
+        logging.info(f'{capture.describe()} killed [exit code: {proc.exited.result()}]')
+        await capture.fail()
+        await capture.restart_if_due()
 
 
 async def main():
     loop = asyncio.get_running_loop()
-    loop.add_signal_handler(signal.SIGTERM, lambda: asyncio.create_task(sigterm_handler()))
-    loop.add_signal_handler(signal.SIGCHLD, lambda: asyncio.create_task(sigchld_handler()))
+    main_task = asyncio.current_task()
+    loop.add_signal_handler(signal.SIGTERM, lambda: asyncio.create_task(sigterm_handler(main_task)))
+    loop.add_signal_handler(signal.SIGHUP, request_reload)
 
     parser = argparse.ArgumentParser()
     parser.add_argument('config_file', help='CCTV JSON configuration file.')
     args = parser.parse_args()
 
-    cfg = config.load(args.config_file)
+    try:
+        cfg = config.load(args.config_file)
+    except config.ConfigError as e:
+        sys.exit(f'Invalid configuration: {e}')
 
-    log_file = os.path.join(cfg.root_path, cfg.logs_dir, cfg.capture_log)
-    logger.configure(log_file, cfg.log_max_bytes, cfg.log_backup_count)
+    logger.configure(cfg.capture_log_file, cfg.log_max_bytes, cfg.log_backup_count)
 
     logging.info('Starting up...')
 
+    process.install_child_watcher()
+
     # Make sure we are not about to write video data to the
     # system SD Card on failure to mount the main SSD drive
     if not system.check_storage_safeguard(cfg.root_path):
         time.sleep(300) # Wait for 5 minutes before rebooting
         system.reboot_host()
 
-    process.CommandProc(cfg.kill_rec_daemon_cmd)
-
     try:
-        await capture_from_cameras(cfg)
+        await capture_from_cameras(args.config_file, cfg)
+    except asyncio.CancelledError:
+        pass  # Shut down
     except Exception:
         logging.exception('Fatal error in main loop')
 
@@ -0,0 +1,101 @@
+import asyncio
+import logging
+import os
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+DEFAULT_IO_THREADS          = 4
+DEFAULT_DELETION_QUEUE_SIZE = 16
+
+LOOP_LAG_INTERVAL_SECS = 0.1    # Interval between event loop lag measurements
+LOOP_LAG_WARNING_SECS  = 0.02   # Log any event loop stall longer than this
+
+# Thread pool for blocking filesystem and ONVIF calls
+IO_POOL = None
+
+
+def configure(io_threads=None):
+    global IO_POOL
+    IO_POOL = ThreadPoolExecutor(max_workers=io_threads or DEFAULT_IO_THREADS, thread_name_prefix='io')
+
+
+async def run_io(func, *args):
+    return await asyncio.get_running_loop().run_in_executor(IO_POOL, func, *args)
+
+
+class DeletionWorker:
+    def __init__(self, max_pending=None, sidecar_exts=()):
+        # Deletions use their own thread so that removing large recordings never holds up other I/O
+        self.pool = ThreadPoolExecutor(max_workers=1, thread_name_prefix='delete')
+        self.sidecar_exts = sidecar_exts  # Extensions of files written alongside each deleted file
+        self.queue = asyncio.Queue(maxsize=max_pending or DEFAULT_DELETION_QUEUE_SIZE)
+        self.task = asyncio.create_task(self.__run())
+
+    # Queue a file for deletion without waiting (check is_full first). Returns a future
+    # that is resolved with True once the file is deleted or False on failure.
+    def submit(self, path):
+        future = asyncio.get_running_loop().create_future()
+        self.queue.put_nowait((path, future))
+        return future
+
+    def is_full(self):
+        return self.queue.full()
+
+    def num_pending(self):
+        return self.queue.qsize()
+
+    async def __run(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            path, future = await self.queue.get()
+            try:
+                await loop.run_in_executor(self.pool, self.__delete, path)
+                result = True
+            except FileNotFoundError:
+                logging.warning(f'Already deleted: {path}')
+                result = True
+            except Exception:
+                logging.exception(f'Failed to delete: {path}')
+                result = False
+            if not future.done():
+                future.set_result(result)
+            self.queue.task_done()
+
+    def __delete(self, path):
+        for ext in self.sidecar_exts:
+            try:
+                os.remove(path + ext)
+            except FileNotFoundError:
+                pass  # Not every file has one
+        os.remove(path)
+
+
+class LoopLagMonitor:
+    def __init__(self):
+        self.reset()
+        self.task = asyncio.create_task(self.__run())
+
+    def reset(self):
+        self.max_lag = 0
+        self.total_lag = 0
+        self.num_samples = 0
+
+    def get_stats(self):
+        mean_lag = self.total_lag / self.num_samples if self.num_samples else 0
+        return self.max_lag, mean_lag
+
+    def log_and_reset(self):
+        max_lag, mean_lag = self.get_stats()
+        logging.debug(f'Event loop lag: max={max_lag * 1000:.1f}ms, mean={mean_lag * 1000:.2f}ms')
+        self.reset()
+
+    async def __run(self):
+        while True:
+            start = time.monotonic()
+            await asyncio.sleep(LOOP_LAG_INTERVAL_SECS)
+            lag = max(0, time.monotonic() - start - LOOP_LAG_INTERVAL_SECS)
+            if lag > LOOP_LAG_WARNING_SECS:
+                logging.warning(f'Event loop stalled for {lag * 1000:.1f}ms')
+            self.max_lag = max(self.max_lag, lag)
+            self.total_lag += lag
+            self.num_samples += 1
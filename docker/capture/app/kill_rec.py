@@ -0,0 +1,121 @@
+import asyncio
+import logging
+import time
+
+HOST = '0.0.0.0'
+PORT = 6666
+
+IDLE_TIMEOUT_SECS = 10    # Time allowed for a client to send its next request before it is disconnected
+MAX_REQUEST_BYTES = 4096  # Longest request line accepted
+MAX_CONCURRENT    = 4     # Requests handled at once (others wait their turn)
+COALESCE_SECS     = 2     # Requests for a camera this soon after its recording was killed share the result
+
+STATUS_OK          = 'ok'           # A new recording has been started
+STATUS_UNKNOWN     = 'unknown'      # No such camera
+STATUS_TIMEOUT     = 'timeout'      # The recording was killed but no new recording appeared in time
+STATUS_UNAVAILABLE = 'unavailable'  # Shutting down
+
+#
+# Requests to kill the current recording of one or more cameras (so that what has been
+# recorded so far can be played back). Each request is a line of space separated camera
+# names and any number of requests can be made over a connection. The reply to each
+# request has a line for each camera giving its name, a status and the name of the new
+# recording started (or "-"), followed by an empty line, e.g:
+#
+# front_door ok front_door_000124.mp4
+# garden unknown -
+#
+# Requests for a camera whose recording is already being killed (or has just been killed)
+# are given the same new recording rather than killing it again.
+#
+
+
+class KillRecServer:
+    def __init__(self, kill_recordings, host=HOST, port=PORT):
+        # Called with the client ID and camera names. Returns the status and new recording of each camera.
+        self.kill_recordings = kill_recordings
+        self.host = host
+        self.port = port
+        self.server = None
+        self.semaphore = asyncio.Semaphore(MAX_CONCURRENT)
+        self.pending = {}  # Camera name -> task killing its recording
+        self.recent = {}   # Camera name -> (time, result) of its last recording killed
+
+    async def start(self):
+        self.server = await asyncio.start_server(self.__handle_connection, self.host, self.port,
+                                                 limit=MAX_REQUEST_BYTES)
+        logging.info(f'Kill recording server running on {self.host}:{self.port}')
+
+    async def close(self):
+        if self.server is not None:
+            self.server.close()
+            await self.server.wait_closed()
+            self.server = None
+
+    async def __handle_connection(self, reader, writer):
+        addr = writer.get_extra_info('peername')
+        client_id = f'{addr[0]}:{addr[1]}'
+        try:
+            while True:
+                msg = await asyncio.wait_for(reader.readline(), IDLE_TIMEOUT_SECS)
+                if not msg:
+                    break  # Client has finished
+                requested_cameras = list(dict.fromkeys(msg.decode().split()))  # Ignore duplicates
+                if not requested_cameras:
+                    continue
+                async with self.semaphore:
+                    results = await self.__handle_request(client_id, requested_cameras)
+                reply = ''.join(f'{name} {status} {new_rec or "-"}\n' for name, (status, new_rec) in results.items())
+                writer.write(f'{reply}\n'.encode())
+                await writer.drain()
+        except asyncio.TimeoutError:
+            logging.debug(f'[{client_id}] Idle connection closed')
+        except ValueError:  # Raised by readline if the request is too long
+            logging.warning(f'[{client_id}] Request longer than {MAX_REQUEST_BYTES} bytes')
+        except (ConnectionError, UnicodeDecodeError) as e:
+            logging.warning(f'[{client_id}] Error: {e}')
+        finally:
+            writer.close()
+
+    async def __handle_request(self, client_id, requested_cameras):
+        now = time.monotonic()
+        tasks = {}
+        to_kill = []
+        for name in requested_cameras:
+            if name in self.pending:
+                logging.info(f'[{client_id}] Kill recording: {name} (already in progress)')
+                tasks[name] = self.pending[name]
+            elif name in self.recent and now - self.recent[name][0] < COALESCE_SECS:
+                logging.info(f'[{client_id}] Kill recording: {name} (killed {now - self.recent[name][0]:.1f}s ago)')
+            else:
+                to_kill.append(name)
+
+        # Cameras not already being killed are killed together
+        if to_kill:
+            task = asyncio.create_task(self.kill_recordings(client_id, to_kill))
+            task.add_done_callback(lambda task: self.__on_killed(to_kill, task))
+            for name in to_kill:
+                self.pending[name] = task
+                tasks[name] = task
+
+        results = {}
+        for name in requested_cameras:
+            if name in tasks:
+                try:
+                    results[name] = (await asyncio.shield(tasks[name]))[name]
+                except Exception:
+                    logging.exception(f'[{client_id}] Failed to kill recording: {name}')
+                    results[name] = (STATUS_UNAVAILABLE, None)
+            else:
+                results[name] = self.recent[name][1]
+        return results
+
+    def __on_killed(self, names, task):
+        now = time.monotonic()
+        for name in names:
+            if self.pending.get(name) is task:
+                del self.pending[name]
+            if not task.cancelled() and task.exception() is None:
+                status, new_rec = task.result()[name]
+                if status == STATUS_OK:
+                    self.recent[name] = (now, (status, new_rec))
@@ -0,0 +1,108 @@
+import logging
+import os
+import shutil
+
+import config
+
+MEMORY_FS_TYPES       = ('tmpfs', 'ramfs')
+BYTES_PER_LIVE_STREAM = 8 * 1024 * 1024  # Rough live output of a stream (for the pre-flight check)
+LOW_FREE_PERCENT      = 10               # Warn when the free memory for live output falls below this
+
+# Root directory of live output when kept in memory (None when it is written to the capture directory)
+MEMORY_PATH = None
+
+#
+# Live streams write a new HLS segment and playlist every second. This output is only
+# needed for a few seconds so it can be kept in memory (e.g. on a tmpfs shared with the
+# webserver) rather than wearing the disk the recordings are written to. The live
+# directory of each stream in the capture directory is then a link to its directory in
+# memory so that the webserver serves it from the same URL.
+#
+
+
+# Check that live output can be kept in memory as configured (falling back to the disk if not)
+def configure(cfg):
+    global MEMORY_PATH
+
+    MEMORY_PATH = None
+    if cfg.live_storage != config.LIVE_STORAGE_MEMORY:
+        return
+
+    path = cfg.live_memory_path
+    num_live_streams = sum(len(cam.streams) for cam in cfg.cameras)
+    try:
+        if not os.path.isdir(path):
+            raise OSError(f'{path} does not exist')
+        fs_type = get_fs_type(path)
+        if fs_type not in MEMORY_FS_TYPES:
+            raise OSError(f'{path} is not memory backed (filesystem: {fs_type})')
+        usage = shutil.disk_usage(path)
+        if usage.free < num_live_streams * BYTES_PER_LIVE_STREAM:
+            logging.warning(f'Only {usage.free / (1024 ** 2):.0f} MB is free in {path} for the live output of '
+                            f'{num_live_streams} streams (about {BYTES_PER_LIVE_STREAM / (1024 ** 2):.0f} MB '
+                            'is needed for each)')
+        test_file = os.path.join(path, '.write_test')
+        with open(test_file, 'w'):
+            pass
+        os.remove(test_file)
+    except OSError as e:
+        logging.error(f'Unable to keep live output in memory: {e}. Writing it to the capture directory instead.')
+        return
+    MEMORY_PATH = path
+    logging.info(f'Keeping live output in memory: {path} ({usage.total / (1024 ** 2):.0f} MB)')
+
+
+# Filesystem type of the mount holding the given path
+def get_fs_type(path):
+    path = os.path.realpath(path)
+    fs_type, mount_point = None, ''
+    with open('/proc/mounts') as mounts:
+        for line in mounts:
+            fields = line.split()
+            if len(fields) < 3:
+                continue
+            point = fields[1].replace('\\040', ' ')
+            if (path == point or path.startswith(point.rstrip('/') + '/')) and len(point) > len(mount_point):
+                fs_type, mount_point = fields[2], point
+    return fs_type
+
+
+# Create an empty output directory for live streaming (removing any left by a previous process)
+def create_live_dir(stream):
+    out_dir = stream.live_dir
+    if os.path.islink(out_dir):
+        os.unlink(out_dir)
+    elif os.path.isdir(out_dir):
+        logging.info(f'Removing directory: {out_dir}')
+        shutil.rmtree(out_dir)
+
+    if MEMORY_PATH is None:
+        os.mkdir(out_dir, 0o777)
+        return out_dir
+
+    memory_dir = os.path.join(MEMORY_PATH, stream.live_dir)
+    if os.path.isdir(memory_dir):
+        shutil.rmtree(memory_dir)
+    os.makedirs(memory_dir, 0o777)
+    os.symlink(memory_dir, out_dir)
+    return out_dir
+
+
+def get_dir_size(path):
+    size = 0
+    try:
+        with os.scandir(path) as it:
+            for entry in it:
+                if entry.is_file(follow_symlinks=False):
+                    size += entry.stat(follow_symlinks=False).st_size
+    except FileNotFoundError:
+        pass
+    return size
+
+
+# Memory used by live output: total and free bytes and the bytes used by each of the given live directories
+def get_usage(live_dirs):
+    if MEMORY_PATH is None:
+        return None
+    usage = shutil.disk_usage(MEMORY_PATH)
+    return usage.total, usage.free, {live_dir : get_dir_size(live_dir) for live_dir in live_dirs}
@@ -0,0 +1,53 @@
+import datetime
+import os
+
+HOLD_BACK_DURATIONS = 3  # Players start at least this many target durations behind the end of the playlist
+
+#
+# Delay of the live output of a stream measured from its HLS playlist. The program date
+# time of each segment gives the wall clock time its media was received, so the delay
+# before the playlist listing the newest segment was written (the publish delay) can be
+# measured. The latency seen by a player is not measured: it is only estimated by adding
+# the hold back players start behind the end of the playlist and the average wait (half a
+# target duration) before they reload the playlist. Camera encoding and network delays
+# are not included in either.
+#
+
+
+# Target duration, media sequence number and wall clock end time (epoch) of the last segment of a playlist
+def parse(text):
+    target_secs, sequence, end_time = None, None, None
+    for line in text.splitlines():
+        tag, _, value = line.partition(':')
+        if tag == '#EXT-X-TARGETDURATION':
+            target_secs = int(value)
+        elif tag == '#EXT-X-MEDIA-SEQUENCE':
+            sequence = int(value)
+        elif tag == '#EXT-X-PROGRAM-DATE-TIME':
+            end_time = datetime.datetime.fromisoformat(value).timestamp()
+        elif tag == '#EXTINF' and end_time is not None:
+            end_time += float(value.split(',')[0])
+    return target_secs, sequence, end_time
+
+
+# Delay of the live output of each of the given streams (by live directory)
+def get_delays(streams):
+    return {stream.live_dir : get_delay(stream) for stream in streams}
+
+
+def get_delay(stream):
+    try:
+        with open(stream.live_playlist) as f:
+            text = f.read()
+        mtime = os.stat(stream.live_playlist).st_mtime
+        target_secs, _, end_time = parse(text)
+    except (OSError, ValueError):
+        return None
+    if target_secs is None or end_time is None:
+        return None
+
+    publish_delay_secs = max(0, mtime - end_time)
+    estimated_latency_secs = publish_delay_secs + HOLD_BACK_DURATIONS * target_secs + target_secs / 2
+    return { 'target_duration_secs'          : target_secs,
+             'publish_delay_secs'            : round(publish_delay_secs, 3),
+             'estimated_player_latency_secs' : round(estimated_latency_secs, 3) }
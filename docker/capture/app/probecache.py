@@ -0,0 +1,136 @@
+import asyncio
+import json
+import logging
+import os
+import subprocess
+
+import executor
+
+PROBE_CACHE_FILENAME = '.probe_cache.json'  # In the capture directory
+PROBE_TIMEOUT_SECS   = 20
+
+# Input options used when the parameters of a stream are already known (ffmpeg otherwise
+# reads up to 5MB or 5s of the stream to find them before producing any output)
+TRIMMED_PROBESIZE              = 256 * 1024
+TRIMMED_ANALYZEDURATION_USECS  = 500000
+TRIMMED_AUDIO_ANALYZE_USECS    = 1000000  # Allow time for the audio parameters to be found too
+
+# Cache file path (set by configure)
+CACHE_FILE = None
+
+# Stream key -> parameters found when the stream was last fully probed
+CACHE = {}
+
+#
+# Parameters of every stream (codecs, dimensions and time bases) found by probing it once
+# after a successful start, so that later restarts can skip most of ffmpeg's probing. The
+# cache entry of a stream is dropped if a start with trimmed probing fails, so the next
+# start probes it in full again.
+#
+
+
+def configure(capture_path):
+    global CACHE_FILE
+    global CACHE
+
+    CACHE_FILE = os.path.join(capture_path, PROBE_CACHE_FILENAME)
+    try:
+        with open(CACHE_FILE) as f:
+            CACHE = json.load(f)
+    except FileNotFoundError:
+        CACHE = {}
+    except (OSError, ValueError) as e:
+        logging.warning(f'Ignoring probe cache ({CACHE_FILE}): {e}')
+        CACHE = {}
+
+
+def get_key(cam, stream):
+    return f'{cam.name}/{stream.name}'
+
+
+# Identifies what is streamed (the cached parameters no longer apply if this changes)
+def get_source(cam, stream):
+    return f'{cam.ip}:{cam.port}{stream.path}'
+
+
+def get(cam, stream):
+    entry = CACHE.get(get_key(cam, stream))
+    if entry is None or entry.get('source') != get_source(cam, stream):
+        return None
+    return entry
+
+
+def get_input_args(params):
+    if params is None:
+        return ()
+    analyze_usecs = TRIMMED_AUDIO_ANALYZE_USECS if params.get('audio') else TRIMMED_ANALYZEDURATION_USECS
+    return ('-probesize', f'{TRIMMED_PROBESIZE}', '-analyzeduration', f'{analyze_usecs}')
+
+
+async def invalidate(cam, stream):
+    if CACHE.pop(get_key(cam, stream), None) is not None:
+        await executor.run_io(save)
+
+
+# Probe the stream in full and cache its parameters
+async def update(cam, stream):
+    params = await probe(stream.url)
+    if params is None:
+        return
+    params['source'] = get_source(cam, stream)
+    if CACHE.get(get_key(cam, stream)) == params:
+        return
+    logging.info(f'Cached stream parameters for {cam.name} [stream:{stream.name}]: {describe(params)}')
+    CACHE[get_key(cam, stream)] = params
+    await executor.run_io(save)
+
+
+def save():
+    if CACHE_FILE is None:
+        return
+    tmp_file = f'{CACHE_FILE}.tmp'
+    with open(tmp_file, 'w') as f:
+        json.dump(CACHE, f, indent=2)
+    os.replace(tmp_file, CACHE_FILE)
+
+
+def describe(params):
+    video = params.get('video') or {}
+    audio = params.get('audio')
+    return f'{video.get("codec")} {video.get("width")}x{video.get("height")}' + \
+           (f' with {audio.get("codec")} audio' if audio else '')
+
+
+async def probe(url):
+    cmd = ('ffprobe', '-v', 'error', '-rtsp_transport', 'tcp', '-show_streams', '-of', 'json', url)
+    try:
+        proc = await asyncio.create_subprocess_exec(*cmd, stdin=subprocess.DEVNULL, stdout=subprocess.PIPE)
+    except OSError as e:
+        logging.warning(f'Unable to probe stream: {e}')
+        return None
+    try:
+        output, _ = await asyncio.wait_for(proc.communicate(), PROBE_TIMEOUT_SECS)
+    except asyncio.TimeoutError:
+        proc.kill()
+        await proc.wait()
+        return None
+    if proc.returncode != 0:
+        return None
+
+    try:
+        streams = json.loads(output).get('streams', [])
+    except ValueError:
+        return None
+    params = { 'video' : None, 'audio' : None }
+    for s in streams:
+        if s.get('codec_type') == 'video' and params['video'] is None:
+            params['video'] = { 'codec'     : s.get('codec_name'),
+                                'width'     : s.get('width'),
+                                'height'    : s.get('height'),
+                                'time_base' : s.get('time_base') }
+        elif s.get('codec_type') == 'audio' and params['audio'] is None:
+            params['audio'] = { 'codec'       : s.get('codec_name'),
+                                'sample_rate' : s.get('sample_rate'),
+                                'channels'    : s.get('channels'),
+                                'time_base'   : s.get('time_base') }
+    return params if params['video'] is not None else None
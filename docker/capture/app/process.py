@@ -1,21 +1,78 @@
-import subprocess
+import asyncio
 import logging
+import os
+import subprocess
+import sys
+
+# Time allowed for a process to exit after being asked to terminate before it is killed
+TERMINATE_TIMEOUT_SECS = 10
+
+
+def install_child_watcher():
+    # Python 3.12+ already uses pidfd where available. Before that, the default
+    # watcher dedicates a thread to every child process, so use pidfd instead.
+    if sys.version_info >= (3, 12) or not hasattr(os, 'pidfd_open'):
+        return
+    try:
+        os.close(os.pidfd_open(os.getpid()))
+    except OSError:
+        logging.info('pidfd is not supported by the kernel. Using default child watcher.')
+        return
+    watcher = asyncio.PidfdChildWatcher()
+    watcher.attach_loop(asyncio.get_running_loop())
+    asyncio.get_event_loop_policy().set_child_watcher(watcher)
 
 
 class CommandProc:
-    def __init__(self, cmd):
+    def __init__(self, cmd, on_exit=None, env=None):
         self.cmd = cmd
+        self.on_exit = on_exit  # Called with this process if it exits without being killed
+        self.env = env  # Environment of the process (inherited if not set)
+        self.process = None
+        self.is_killed = False
+        self.is_force_killed = False  # Set if the process had to be killed with SIGKILL
+        self.exited_unexpectedly = False  # Set if the process exited without being killed
+        self.exited = asyncio.get_running_loop().create_future()  # Result is the exit code
+        self.waiter = None
+
+    async def start(self):
         logging.info(f'Invoking command: {self.get_cmd()}')
-        self.process = subprocess.Popen(self.cmd)
+        self.process = await asyncio.create_subprocess_exec(*self.cmd, stdin=subprocess.DEVNULL, env=self.env)
+        self.waiter = asyncio.create_task(self.__wait())
+
+    async def __wait(self):
+        returncode = await self.process.wait()  # Reaps the process
+        self.exited_unexpectedly = not self.is_killed
+        self.exited.set_result(returncode)
+        if not self.is_killed and self.on_exit is not None:
+            self.on_exit(self)
 
     def is_alive(self):
-        if self.process.poll() is None:
+        if self.process is not None and self.process.returncode is None:
             return True
         return False
 
-    def kill(self):
-        self.process.terminate()
+    async def kill(self, timeout_secs=TERMINATE_TIMEOUT_SECS):
+        self.is_killed = True
+        if self.process is None:
+            return None
+        if self.is_alive():
+            try:
+                self.process.terminate()
+                return await asyncio.wait_for(asyncio.shield(self.exited), timeout_secs)
+            except ProcessLookupError:
+                pass
+            except asyncio.TimeoutError:
+                logging.warning(f'Process {self.get_pid()} still running after {timeout_secs}s. Killing...')
+                self.is_force_killed = True
+                try:
+                    self.process.kill()
+                except ProcessLookupError:
+                    pass
+        return await self.exited
+
+    def get_pid(self):
+        return self.process.pid if self.process is not None else None
 
     def get_cmd(self):
         return ' '.join(self.cmd)
-
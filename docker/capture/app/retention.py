@@ -0,0 +1,139 @@
+import asyncio
+import logging
+import os
+import re
+import time
+from collections import OrderedDict
+
+import executor
+import segname
+
+
+class Segment:
+    __slots__ = ('cam_name', 'filename', 'key', 'size')
+
+    def __init__(self, cam_name, filename, key, size):
+        self.cam_name = cam_name
+        self.filename = filename
+        self.key      = key   # Segment start time (used for ordering)
+        self.size     = size
+
+
+class RetentionIndex:
+    def __init__(self, capture_path, cameras):
+        self.capture_path = capture_path
+        self.cameras      = {}  # Camera name -> OrderedDict of filename -> Segment (oldest first)
+        self.usage        = {}  # Camera name -> total bytes of its segments (kept up to date incrementally)
+        self.size_updates = set()  # Tasks getting the size of closed segments
+
+        for cam in cameras:
+            self.add_camera(cam.name, self.scan_camera(cam))
+
+    def add_camera(self, cam_name, entries):
+        self.cameras[cam_name] = OrderedDict()
+        self.usage[cam_name] = 0
+        for mtime, filename, size in entries:
+            self.__insert(cam_name, filename, mtime, size)
+        logging.info(f'Indexed {len(entries)} recordings for {cam_name}')
+
+    # The only directory scan: performed once when a camera is first indexed (this does not
+    # modify the index so can be run off the event loop before passing the result to add_camera)
+    def scan_camera(self, cam):
+        entries = []
+        cam_dir = os.path.join(self.capture_path, cam.name)
+        # Only the camera's recording segments (not e.g. temporary files written while repairing them)
+        record_regex = re.compile(cam.record_regex)
+        if os.path.isdir(cam_dir):
+            with os.scandir(cam_dir) as it:
+                for entry in it:
+                    if record_regex.match(entry.name) and entry.is_file():
+                        stat_info = entry.stat()
+                        # Segments named by their start time are ordered by it
+                        key = segname.get_start_time(entry.name) or stat_info.st_mtime
+                        entries.append((key, entry.name, stat_info.st_size))
+        entries.sort()
+        return entries
+
+    def remove_camera(self, cam_name):
+        self.cameras.pop(cam_name, None)
+        self.usage.pop(cam_name, None)
+
+    def add_segment(self, cam_name, filename, key=None, size=0):
+        if cam_name not in self.cameras:
+            self.cameras[cam_name] = OrderedDict()
+            self.usage[cam_name] = 0
+        if filename in self.cameras[cam_name]:  # Segment number has wrapped
+            self.remove_segment(cam_name, filename)
+        self.__insert(cam_name, filename, time.time() if key is None else key, size)
+
+    def remove_segment(self, cam_name, filename):
+        segments = self.cameras.get(cam_name)
+        if segments is not None:
+            segment = segments.pop(filename, None)
+            if segment is not None:
+                self.usage[cam_name] -= segment.size
+
+    def update_size(self, cam_name, filename, size):
+        segment = self.get_segment(cam_name, filename)
+        if segment is not None:
+            self.usage[cam_name] += size - segment.size
+            segment.size = size
+
+    # Notification that a recorder has started writing a new segment
+    def segment_created(self, cam_name, filename):
+        self.add_segment(cam_name, filename, segname.get_start_time(filename))
+
+    # Notification that a recorder has finished writing a segment
+    def segment_closed(self, cam_name, filename):
+        segment = self.get_segment(cam_name, filename)
+        if segment is None:
+            return
+        task = asyncio.create_task(self.__update_closed_size(segment))
+        self.size_updates.add(task)
+        task.add_done_callback(self.size_updates.discard)
+
+    async def __update_closed_size(self, segment):
+        try:
+            size = await executor.run_io(os.path.getsize, self.get_path(segment))
+        except FileNotFoundError:
+            size = None
+        if self.get_segment(segment.cam_name, segment.filename) is not segment:
+            return  # Removed (or replaced by a wrapped segment) while getting its size
+        if size is None:
+            self.remove_segment(segment.cam_name, segment.filename)
+        else:
+            self.update_size(segment.cam_name, segment.filename, size)
+
+    # Notification that a segment has been removed by another process
+    def segment_deleted(self, cam_name, filename):
+        self.remove_segment(cam_name, filename)
+
+    def get_segment(self, cam_name, filename):
+        segments = self.cameras.get(cam_name)
+        if segments is None:
+            return None
+        return segments.get(filename)
+
+    def get_path(self, segment):
+        return os.path.join(self.capture_path, segment.cam_name, segment.filename)
+
+    def oldest_for_camera(self, cam_name):
+        segments = self.cameras.get(cam_name)
+        if not segments:
+            return None
+        return next(iter(segments.values()))
+
+    def num_segments(self, cam_name=None):
+        if cam_name is not None:
+            return len(self.cameras.get(cam_name, ()))
+        return sum(len(segments) for segments in self.cameras.values())
+
+    def get_usage(self, cam_name=None):
+        if cam_name is not None:
+            return self.usage.get(cam_name, 0)
+        return sum(self.usage.values())
+
+    def __insert(self, cam_name, filename, key, size):
+        segment = Segment(cam_name, filename, key, size)
+        self.cameras[cam_name][filename] = segment
+        self.usage[cam_name] += size
@@ -0,0 +1,21 @@
+import json
+import os
+import time
+
+#
+# Status of every camera (e.g. the state and restart counters of each stream) written as
+# JSON after each health check so that failing cameras can be monitored from outside
+#
+
+
+def write(status_file, cameras, live_storage=None, live_delay=None, disk_usage=None):
+    status = { 'time'         : time.time(),
+               'cameras'      : cameras,
+               'live_storage' : live_storage,
+               'live_delay'   : live_delay,
+               'disk_usage'   : disk_usage }
+    # Replace the file in one step so that readers never see it partly written
+    tmp_file = f'{status_file}.tmp'
+    with open(tmp_file, 'w') as f:
+        json.dump(status, f, indent=2)
+    os.replace(tmp_file, status_file)
@@ -1,19 +1,44 @@
+import asyncio
 import logging
 import os
 import re
-import math
-import glob
-import shutil
+import time
 from abc import ABC, abstractmethod
-from datetime import datetime, timezone
 
+import backoff
+import config
+import livestore
+import probecache
 import process
 
+# Muxer options for fragmented MP4 recordings: a fragment is written at every keyframe
+# after an initial moov atom (which describes the tracks but holds no samples)
+FMP4_FORMAT_OPTIONS = 'movflags=+frag_keyframe+empty_moov+default_base_moof'
+
+# HLS muxer flags of live streams (program date times are included so that the delay in
+# publishing each segment can be measured)
+LIVE_HLS_FLAGS = 'delete_segments+program_date_time'
+
+# Audio bitstream filter that advances audio by the given seconds (retimes the audio packets
+# of the single input rather than opening the stream a second time with an offset)
+AUDIO_ADVANCE_BSF = 'setts=ts=TS+{secs}/TB'
+
+# Time allowed for a new process to produce its first output before probing it in full next time
+FIRST_OUTPUT_TIMEOUT_SECS = 30
+
 
 class StreamCapture(ABC):
-    def __init__(self, cam, stream):
-        self.name, self.username, self.password, self.ip, self.port, self.stream, self.capture_proc = \
-            cam.name, cam.username, cam.password, cam.ip, cam.port, stream, None
+    def __init__(self, cam, stream, watcher, on_restart=None):
+        self.cam, self.name, self.stream, self.capture_proc = cam, cam.name, stream, None
+        self.watcher = watcher
+        # Called with this capture and its process when the process needs restarting (e.g. it exited unexpectedly)
+        self.on_restart = on_restart
+        self.watch = None  # Watch state of the output (set by subclasses)
+        self.restarts = backoff.RestartBackoff(self.describe())
+        self.probe_params = None          # Cached stream parameters used by the current process (if any)
+        self.time_to_first_output = None  # Seconds taken by the last process started to produce output
+        self.first_output = None          # Task resolved with whether the last process started produced output
+        self.startup_secs = None          # Time from the service starting until this produced output
 
         # Create top level camera capture directory
         if not os.path.isdir(self.name):
@@ -26,59 +51,125 @@ class StreamCapture(ABC):
         return True
 
     @abstractmethod
-    def _start(self):
+    def _build_cmd(self):
+        raise NotImplementedError()
+
+    @abstractmethod
+    def describe(self):
         raise NotImplementedError()
 
-    def kill(self):
+    def get_url(self):
+        return self.stream.url
+
+    def _get_env(self):
+        return None  # Inherit the environment
+
+    def _get_input_args(self):
+        return probecache.get_input_args(self.probe_params)
+
+    async def start(self):
+        await self.watch.scanned  # The command depends on the existing output (e.g. the segment start number)
+        # Skip most of the probing of a stream whose parameters are already known
+        self.probe_params = probecache.get(self.cam, self.stream)
+        self.capture_proc = process.CommandProc(self._build_cmd(), self._request_restart, self._get_env())
+        first_output = self.watch.get_next_write()
+        await self.capture_proc.start()
+        self.watch.touch()  # Allow time for the new process to produce output
+        self.first_output = asyncio.create_task(self.__wait_for_first_output(self.capture_proc, first_output,
+                                                                             self.probe_params))
+
+    async def __wait_for_first_output(self, proc, first_output, probe_params):
+        start_time = time.monotonic()
+        done, _ = await asyncio.wait((first_output, proc.exited), timeout=FIRST_OUTPUT_TIMEOUT_SECS,
+                                     return_when=asyncio.FIRST_COMPLETED)
+        if first_output in done:
+            self.time_to_first_output = time.monotonic() - start_time
+            logging.info(f'{self.describe()}: first output after {self.time_to_first_output:.1f}s '
+                         f'({"trimmed" if probe_params is not None else "full"} probe)')
+            if probe_params is None:
+                asyncio.create_task(probecache.update(self.cam, self.stream))
+            return True
+
+        first_output.cancel()
+        if proc.exited.done() and not proc.exited_unexpectedly:
+            return False  # Killed before producing any output (e.g. on shutdown)
+        if probe_params is not None:
+            # The stream may have changed (e.g. a new resolution) so probe it in full next time
+            logging.info(f'{self.describe()}: no output with trimmed probe. Probing in full on the next start.')
+            await probecache.invalidate(self.cam, self.stream)
+        return False
+
+    async def kill(self, timeout_secs=process.TERMINATE_TIMEOUT_SECS):
         if self.capture_proc is not None:
-            self.capture_proc.kill()
-            self.capture_proc = None
+            capture_proc, self.capture_proc = self.capture_proc, None
+            await capture_proc.kill(timeout_secs)
+
+    async def restart(self):
+        await self.kill()
+        await self.start()
 
-    def restart(self):
-        self.kill()
-        self._start()
+    # Kill the process and stop watching its output (when the stream is no longer captured)
+    async def stop(self):
+        await self.kill()
+        self.watcher.unwatch(self.watch)
+
+    # Record that the process has failed (i.e. exited or stopped producing output)
+    async def fail(self):
+        await self.kill()
+        self.restarts.on_failure()
+
+    # Restart the process after a failure once its backoff allows (and the camera can be
+    # reached). Returns True if it was restarted.
+    async def restart_if_due(self):
+        if not self.restarts.is_due():
+            return False
+        self.restarts.on_probing()
+        if not await backoff.probe(self.cam.ip, self.cam.port):
+            logging.info(f'#### {self.describe()}: camera is unreachable ({self.cam.ip}:{self.cam.port})')
+            self.restarts.on_probe_failure()
+            return False
+        logging.info(f'#### Restarting: {self.describe()}...')
+        await self.restart()
+        self.restarts.on_started()
+        return True
+
+    def _request_restart(self, proc):
+        if self.on_restart is not None:
+            self.on_restart(self, proc)
 
     def get_cmd(self):
         return self.capture_proc.get_cmd()
 
 
 class LiveStreamCapture(StreamCapture):
-    def __init__(self, cam, stream, no_update_is_dead_secs):
-        super().__init__(cam, stream)
-
-        # Create output directory for live streaming
-        out_dir = f'{self.name}/{stream.name}'
-        if os.path.isdir(out_dir):
-            logging.info(f'Removing directory: {out_dir}')
-            shutil.rmtree(out_dir)
-        if not os.path.isdir(out_dir):
-            os.mkdir(out_dir, 0o777)
-
-        self.out_playlist = f'{out_dir}/live.m3u8'
+    def __init__(self, cam, stream, watcher, no_update_is_dead_secs, on_restart=None, watch=None):
+        super().__init__(cam, stream, watcher, on_restart)
+
+        self.out_playlist = stream.live_playlist
         self.no_update_is_dead_secs = no_update_is_dead_secs
-        self._start()
+        if watch is not None:
+            self.watch = watch  # Output directory already created and watched by another capture
+        else:
+            out_dir = livestore.create_live_dir(stream)
+            self.watch = self.watcher.watch(self.name, out_dir, r'^live\.m3u8$', stale_secs=no_update_is_dead_secs)
+
+    def describe(self):
+        return f'Live streaming from {self.name} [stream:{self.stream.name}]'
 
-    def _start(self):
-        url = f'rtsp://{self.username}:{self.password}@{self.ip}:{self.port}{self.stream.path}'
+    def _build_cmd(self):
+        url = self.get_url()
         cmd = []
         cmd.append(('ffmpeg'))
         cmd.extend(('-fflags', 'nobuffer'))
         cmd.extend(('-rtsp_transport', 'tcp'))
+        cmd.extend(self._get_input_args())
         cmd.extend(('-i', url))
 
-        if (self.stream.include_audio):
-            if (self.stream.live_audio_advance_secs is not None):
-                # Advance timestamps in the next (second) input stream
-                cmd.extend(('-itsoffset', f'{self.stream.live_audio_advance_secs}'))
-                # Specify a second (same) input stream
-                cmd.extend(('-i', url))
-                # Take the video from the first input stream
-                cmd.extend(('-map', '0:0'))
-                # Take the audio from the second input stream
-                cmd.extend(('-map', '1:1'))
-            else:
-                cmd.extend(('-map', '0'))
+        if self.stream.include_audio:
+            cmd.extend(('-map', '0'))
             cmd.extend(('-c:a', 'copy'))  # Copy the audio
+            if self.stream.live_audio_advance_secs is not None:
+                cmd.extend(('-bsf:a', AUDIO_ADVANCE_BSF.format(secs=self.stream.live_audio_advance_secs)))
         else:
             cmd.extend(('-map', '0:0'))
 
@@ -86,80 +177,223 @@ class LiveStreamCapture(StreamCapture):
         cmd.extend(('-f', 'hls'))
         cmd.extend(('-hls_time', '1'))
         cmd.extend(('-hls_list_size', '10'))
-        cmd.extend(('-hls_flags', 'delete_segments'))
+        cmd.extend(('-hls_flags', LIVE_HLS_FLAGS))
         cmd.extend(('-hls_segment_type', 'fmp4'))
         if self.stream.aspect is not None:
             cmd.extend(('-aspect', self.stream.aspect))
-        if (self.stream.xargs is not None):  # Add any extra arguments (ensuring we split on whitespace)
-            cmd.extend((self.stream.xargs.split()))
+        cmd.extend(self.stream.xargs)  # Add any extra arguments
         cmd.append((self.out_playlist))
-
-        self.capture_proc = process.CommandProc(cmd)
+        return cmd
 
     def is_alive(self):
         if not super().is_alive():
             return False
-        if not os.path.isfile(self.out_playlist):
+        if self.watch.current is None:
             return False
-        secs_since_last_update = int(datetime.now(timezone.utc).timestamp() - os.lstat(self.out_playlist).st_mtime)
-        if (secs_since_last_update > self.no_update_is_dead_secs):
+        if (self.watch.secs_since_last_write() > self.no_update_is_dead_secs):
             return False
         return True
 
 
 class RecordStreamCapture(StreamCapture):
-    def __init__(self, cam, stream, seg_time, seg_wrap, no_update_is_dead_secs):
-        super().__init__(cam, stream)
+    def __init__(self, cam, stream, watcher, seg_time, seg_wrap, no_update_is_dead_secs, segment_listener=None,
+                 on_restart=None):
+        super().__init__(cam, stream, watcher, on_restart)
 
         self.seg_time = seg_time
         self.seg_wrap = seg_wrap
         self.no_update_is_dead_secs = no_update_is_dead_secs
+        self.is_fragmented = cam.record_container == config.RECORD_CONTAINER_FMP4
+        self.is_time_named = cam.segment_naming == config.SEGMENT_NAMING_TIME
+        self.segment_listener = segment_listener
+        self.segment_waiters = []  # Futures resolved with the name of the next segment created
+
+        # Output format and search pattern for recording segments
+        self.out_record_format = cam.record_format
+        self.out_record_regex = cam.record_regex
 
-        # Setup output format and search pattern for recording segments
-        self.out_record_format = f'{self.name}/{self.name}_%0{str(int(math.log10(self.seg_wrap)) + 1)}d.mp4'
-        self.out_record_search = re.sub('%0\d+d', '*', self.out_record_format)
+        # Track the current segment (notifying the listener as segments are created and closed)
+        self.watch = self.watcher.watch(self.name, self.name, self.out_record_regex, self, no_update_is_dead_secs)
 
-        self._start()
+    def describe(self):
+        return f'Recording from {self.name}'
 
-    def _start(self):
-        url = f'rtsp://{self.username}:{self.password}@{self.ip}:{self.port}{self.stream.path}'
+    def _build_cmd(self):
+        url = self.get_url()
         cmd = []
         cmd.append(('ffmpeg'))
         cmd.extend(('-rtsp_transport', 'tcp'))  # Prevent use of UDP to avoid packet loss
+        cmd.extend(self._get_input_args())
         cmd.extend(('-i', url))
         cmd.extend(('-c', 'copy'))  # Take an exact copy of the input stream
         cmd.extend(('-map', '0:0' if not self.stream.include_audio else '0'))
         cmd.extend(('-f', 'segment'))
         cmd.extend(('-segment_time', f'{self.seg_time}'))
-        cmd.extend(('-segment_wrap', f'{self.seg_wrap}'))
-        cmd.extend(('-segment_start_number', f'{self.get_segment_start_num()}'))
+        if self.is_time_named:
+            cmd.extend(('-segment_atclocktime', '1'))  # Start segments on the clock (e.g. on the hour)
+            cmd.extend(('-strftime', '1'))             # Name segments by their start time
+        else:
+            cmd.extend(('-segment_wrap', f'{self.seg_wrap}'))
+            cmd.extend(('-segment_start_number', f'{self.get_segment_start_num()}'))
         cmd.extend(('-reset_timestamps', '1'))
+        if self.is_fragmented:
+            cmd.extend(('-segment_format_options', FMP4_FORMAT_OPTIONS))
         if self.stream.vtag is not None:
             cmd.extend(('-tag:v', self.stream.vtag))
         if self.stream.aspect is not None:
             cmd.extend(('-aspect', self.stream.aspect))
         cmd.append((self.out_record_format))
-
-        self.capture_proc = process.CommandProc(cmd)
+        return cmd
 
     def is_alive(self):
         if not super().is_alive():
             return False
-        files = sorted(glob.glob(self.out_record_search), key=os.path.getmtime, reverse=True)
-        if (len(files) == 0):
+        if self.watch.current is None:
             return False
-        secs_since_last_update = int(datetime.now(timezone.utc).timestamp() - os.lstat(files[0]).st_mtime)
-        if (secs_since_last_update > self.no_update_is_dead_secs):
+        if (self.watch.secs_since_last_write() > self.no_update_is_dead_secs):
             return False
         return True
 
+    def _get_env(self):
+        if not self.is_time_named:
+            return None
+        # Segment times and filenames are in UTC (ffmpeg uses local time for both)
+        return dict(os.environ, TZ='UTC')
+
     def get_segment_start_num(self):
-        files = sorted(glob.glob(self.out_record_search), key=os.path.getmtime, reverse=True)
-        if (len(files) == 0):
+        current = self.watch.current
+        if current is None:
             return 0
-        match = re.search(r'^.*?(\d+)\..*+$', files[0])
+        match = re.search(r'^.*?(\d+)\..*+$', current)
         if match:
             return int(match.group(1)) + 1  # Segment number
         else:
-            raise Exception(f'Unable to determine segment start number ({files[0]})')
+            raise Exception(f'Unable to determine segment start number ({current})')
+
+    # Get a future resolved with the name of the next segment created
+    def get_next_segment(self):
+        future = asyncio.get_running_loop().create_future()
+        self.segment_waiters.append(future)
+        return future
+
+    def segment_created(self, cam_name, filename):
+        waiters, self.segment_waiters = self.segment_waiters, []
+        for future in waiters:
+            if not future.done():
+                future.set_result(filename)
+        if self.segment_listener is not None:
+            self.segment_listener.segment_created(cam_name, filename)
+
+    def segment_closed(self, cam_name, filename):
+        if self.segment_listener is not None:
+            self.segment_listener.segment_closed(cam_name, filename)
+
+    def segment_deleted(self, cam_name, filename):
+        if self.segment_listener is not None:
+            self.segment_listener.segment_deleted(cam_name, filename)
+
+
+# Records the stream and live streams it from a single RTSP ingest using the tee muxer
+class CombinedStreamCapture(RecordStreamCapture):
+    def __init__(self, cam, stream, watcher, seg_time, seg_wrap, no_update_is_dead_secs, segment_listener=None,
+                 on_restart=None):
+        self.live_fallback = None  # Separate live stream used while the live output of the process has failed
+        super().__init__(cam, stream, watcher, seg_time, seg_wrap, no_update_is_dead_secs, segment_listener,
+                         on_restart)
+
+        out_dir = livestore.create_live_dir(stream)
+        self.out_playlist = stream.live_playlist
+        self.live_watch = self.watcher.watch(self.name, out_dir, r'^live\.m3u8$', stale_secs=no_update_is_dead_secs)
+
+        if self.stream.xargs:
+            logging.warning(f'{self.name} [stream:{stream.name}]: xargs are only used by a separate live stream '
+                            'in combined capture mode (not the combined recording and live stream)')
+
+    def describe(self):
+        return f'Recording and live streaming from {self.name} [stream:{self.stream.name}]'
+
+    def _build_cmd(self):
+        url = self.get_url()
+        cmd = []
+        cmd.append(('ffmpeg'))
+        # Live streaming options (-fflags nobuffer and xargs) are left out as they would also apply to the recording
+        cmd.extend(('-rtsp_transport', 'tcp'))  # Prevent use of UDP to avoid packet loss
+        cmd.extend(self._get_input_args())
+        cmd.extend(('-i', url))
+        cmd.extend(('-c', 'copy'))  # Take an exact copy of the input stream
+        cmd.extend(('-map', '0:0' if not self.stream.include_audio else '0'))
+        if self.stream.vtag is not None:
+            cmd.extend(('-tag:v', self.stream.vtag))
+        if self.stream.aspect is not None:
+            cmd.extend(('-aspect', self.stream.aspect))
+
+        # Recording failures abort the process whereas live streaming failures are ignored (see get_output_health)
+        record_opts = ['f=segment', f'segment_time={self.seg_time}']
+        if self.is_time_named:
+            record_opts.extend(('segment_atclocktime=1', 'strftime=1'))
+        else:
+            record_opts.extend((f'segment_wrap={self.seg_wrap}',
+                                f'segment_start_number={self.get_segment_start_num()}'))
+        record_opts.extend(('reset_timestamps=1', 'onfail=abort'))
+        if self.is_fragmented:
+            record_opts.append(f'segment_format_options={FMP4_FORMAT_OPTIONS}')
+        record_opts = ':'.join(record_opts)
+        live_opts = ['f=hls',
+                     'hls_time=1',
+                     'hls_list_size=10',
+                     f'hls_flags={LIVE_HLS_FLAGS}',
+                     'hls_segment_type=fmp4',
+                     'onfail=ignore']
+        if self.stream.include_audio and self.stream.live_audio_advance_secs is not None:
+            # Only the live output is advanced (recordings keep the audio timing of the camera)
+            live_opts.append(f'bsfs/a={AUDIO_ADVANCE_BSF.format(secs=self.stream.live_audio_advance_secs)}')
+        live_opts = ':'.join(live_opts)
+        cmd.extend(('-f', 'tee'))
+        cmd.append((f'[{record_opts}]{self.out_record_format}|[{live_opts}]{self.out_playlist}'))
+        return cmd
+
+    async def start(self):
+        await super().start()
+        self.live_watch.touch()
+
+    async def kill(self, timeout_secs=process.TERMINATE_TIMEOUT_SECS):
+        await self.stop_live_fallback()  # The next process resumes the live output
+        await super().kill(timeout_secs)
+
+    async def stop(self):
+        await super().stop()
+        self.watcher.unwatch(self.live_watch)
+
+    def get_output_health(self):
+        is_running = self.capture_proc is not None and self.capture_proc.is_alive()
+        if self.live_fallback is not None:
+            is_running = self.live_fallback.capture_proc is not None and self.live_fallback.capture_proc.is_alive()
+        is_live_updating = self.live_watch.current is not None and \
+            self.live_watch.secs_since_last_write() <= self.no_update_is_dead_secs
+        # The process is only considered dead (see is_alive) if its recording output fails
+        return {'record': self.is_alive(), 'live': is_running and is_live_updating}
+
+    def is_live_alive(self):
+        return self.get_output_health()['live']
+
+    # Live stream from a separate ingest until the process is next killed. The tee muxer
+    # gives up on a failed live output, but restarting the process to recover it would cut
+    # the current recording short.
+    async def start_live_fallback(self):
+        fallback = self.live_fallback
+        if fallback is None:
+            logging.info(f'#### Live output from {self.name} [stream:{self.stream.name}] has failed. '
+                         'Live streaming separately until the recording is restarted...')
+            self.live_fallback = LiveStreamCapture(self.cam, self.stream, self.watcher, self.no_update_is_dead_secs,
+                                                   self.on_restart, self.live_watch)
+            await self.live_fallback.start()
+            return
+        if fallback.restarts.is_running():
+            logging.info(f'#### {fallback.describe()} is dead.')
+            await fallback.fail()
+        await fallback.restart_if_due()
 
+    async def stop_live_fallback(self):
+        if self.live_fallback is not None:
+            fallback, self.live_fallback = self.live_fallback, None
+            await fallback.kill()
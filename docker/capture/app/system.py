@@ -51,8 +51,11 @@ def reboot_host():
         logging.info("Attempting namespace-escaped host reboot")
         sys.stderr.flush()
 
-        # Tell the host's systemd/system-init to reboot cleanly
-        subprocess.run(["nsenter", "--target", "1", "--mount", "--uts", "--ipc", "--net", "--pid", "reboot"], check=True)
+        # Tell the host's systemd/system-init to reboot cleanly (the container has its own PID
+        # namespace so the namespaces of the host's init are found through the host's /proc)
+        host_ns = [f"--{ns}=/host_proc/1/ns/{name}" for ns, name in
+                   (("mount", "mnt"), ("uts", "uts"), ("ipc", "ipc"), ("net", "net"), ("pid", "pid"))]
+        subprocess.run(["nsenter", *host_ns, "reboot"], check=True)
 
         # Wait for termination
         time.sleep(10)
@@ -0,0 +1,220 @@
+import asyncio
+import logging
+import os
+import re
+import time
+
+import executor
+import inotify
+
+WATCH_MASK = inotify.IN_CREATE | inotify.IN_MODIFY | inotify.IN_CLOSE_WRITE | inotify.IN_MOVED_TO | \
+             inotify.IN_MOVED_FROM | inotify.IN_DELETE | inotify.IN_ONLYDIR
+
+STALE_CHECK_SECS = 1  # Interval between checks for outputs that have stopped updating
+
+
+class WatchState:
+    def __init__(self, name, path, pattern, listener, stale_secs):
+        self.name       = name     # Name passed to the listener (e.g. camera name)
+        self.path       = path     # Absolute path of the watched directory
+        self.pattern    = re.compile(pattern)
+        self.listener   = listener
+        self.stale_secs = stale_secs
+        self.current    = None     # Most recently created matching file
+        self.last_write = 0        # Time of the last write to the current file
+        self.is_stale   = False    # Set once the current file has stopped updating
+        self.wd         = None
+        self.dir_mtime  = None     # Only used when polling
+        self.entries    = None     # Only used when polling
+        self.write_waiters = []    # Futures resolved on the next write to a matching file
+        self.scanned    = None     # Task completed once the initial state has been established
+
+    def secs_since_last_write(self):
+        return time.time() - self.last_write
+
+    # Get a future resolved with the name of the next file written (e.g. the first output of a new process)
+    def get_next_write(self):
+        future = asyncio.get_running_loop().create_future()
+        self.write_waiters.append(future)
+        return future
+
+    def touch(self):
+        # Treat the output as freshly written (e.g. after restarting the process writing it)
+        self.last_write = time.time()
+        self.is_stale = False
+
+
+class SegmentWatcher:
+    def __init__(self, poll_interval_secs=1, on_stale=None):
+        self.poll_interval_secs = poll_interval_secs
+        self.on_stale = on_stale  # Optional callback made when a watched output stops updating
+        self.states = []
+        self.wds = {}  # Watch descriptor -> WatchState
+        self.tasks = []
+        self.rescan = None  # Task rescanning every watched directory (after events have been lost)
+
+        self.inotify = inotify.Inotify() if inotify.is_supported() else None
+        if self.inotify is None:
+            logging.warning('inotify is not available. Falling back to polling for output changes.')
+
+    def start(self):
+        loop = asyncio.get_running_loop()
+        if self.inotify is not None:
+            loop.add_reader(self.inotify.fileno(), self.__on_inotify_events)
+        else:
+            self.tasks.append(asyncio.create_task(self.__poll()))
+        self.tasks.append(asyncio.create_task(self.__check_for_stale_outputs()))
+
+    def watch(self, name, path, pattern, listener=None, stale_secs=None):
+        state = WatchState(name, os.path.abspath(path), pattern, listener, stale_secs)
+        if self.inotify is not None:
+            # Watch before listing the directory so that no changes are missed
+            state.wd = self.inotify.add_watch(state.path, WATCH_MASK)
+            self.wds[state.wd] = state
+        self.states.append(state)
+        # Establish the initial state off the event loop (the only full directory listing)
+        state.scanned = asyncio.create_task(self.__scan(state, is_initial=True))
+        return state
+
+    def unwatch(self, state):
+        if state in self.states:
+            self.states.remove(state)
+        if state.scanned is not None and not state.scanned.done():
+            state.scanned.cancel()
+        if state.wd is not None:
+            self.wds.pop(state.wd, None)
+            self.inotify.rm_watch(state.wd)
+            state.wd = None
+
+    async def __scan(self, state, is_initial=False):
+        state.dir_mtime, state.entries = await executor.run_io(list_dir, state.path, state.pattern)
+        newest = max(state.entries, key=state.entries.get, default=None)
+        if newest is None or newest == state.current:
+            return
+        if is_initial and state.current is not None:
+            return  # Already superseded by a change seen while listing the directory
+        state.current, state.last_write = newest, max(state.last_write, state.entries[newest])
+
+    async def __rescan(self):
+        for state in list(self.states):
+            try:
+                await self.__scan(state)
+            except Exception:
+                logging.exception(f'Failed to rescan {state.path}')
+
+    def __on_inotify_events(self):
+        now = time.time()
+        for wd, mask, filename in self.inotify.read_events():
+            if mask & inotify.IN_Q_OVERFLOW:
+                logging.warning('inotify event queue overflowed. Rescanning watched directories.')
+                if self.rescan is None or self.rescan.done():
+                    self.rescan = asyncio.create_task(self.__rescan())
+                continue
+            state = self.wds.get(wd)
+            if state is None or not state.pattern.match(filename):
+                continue
+            if mask & (inotify.IN_CREATE | inotify.IN_MOVED_TO):
+                self.__on_created(state, filename, now)
+            elif mask & inotify.IN_MODIFY:
+                self.__on_modified(state, filename, now)
+            elif mask & inotify.IN_CLOSE_WRITE:
+                self.__on_closed(state, filename)
+            elif mask & (inotify.IN_DELETE | inotify.IN_MOVED_FROM):
+                self.__on_deleted(state, filename)
+
+    def __on_created(self, state, filename, now):
+        if filename != state.current:
+            state.current = filename
+            if state.listener is not None:
+                state.listener.segment_created(state.name, filename)
+        self.__on_modified(state, filename, now)
+
+    def __on_modified(self, state, filename, now):
+        if filename == state.current:
+            state.last_write = now
+            state.is_stale = False
+            waiters, state.write_waiters = state.write_waiters, []
+            for future in waiters:
+                if not future.done():
+                    future.set_result(filename)
+
+    def __on_closed(self, state, filename):
+        if state.listener is not None:
+            state.listener.segment_closed(state.name, filename)
+
+    def __on_deleted(self, state, filename):
+        if filename == state.current:
+            state.current = None
+        if state.listener is not None:
+            state.listener.segment_deleted(state.name, filename)
+
+    async def __poll(self):
+        while True:
+            await asyncio.sleep(self.poll_interval_secs)
+            now = time.time()
+            for state in list(self.states):
+                if state.entries is None:
+                    continue  # Initial state not yet established
+                try:
+                    await self.__poll_state(state, now)
+                except Exception:
+                    logging.exception(f'Failed to poll {state.path}')
+
+    async def __poll_state(self, state, now):
+        # Only list the directory when entries have been added or removed
+        dir_mtime = await executor.run_io(get_mtime, state.path)
+        if dir_mtime is None:
+            return
+        if dir_mtime != state.dir_mtime:
+            previous, previous_current = state.entries, state.current
+            await self.__scan(state)
+            for filename in previous.keys() - state.entries.keys():
+                self.__on_deleted(state, filename)
+            for filename in sorted(state.entries.keys() - previous.keys(), key=state.entries.get):
+                if previous_current is not None and state.listener is not None:
+                    state.listener.segment_closed(state.name, previous_current)
+                previous_current = filename
+                if state.listener is not None:
+                    state.listener.segment_created(state.name, filename)
+
+        # Otherwise just check the current file for writes
+        if state.current is not None:
+            mtime = await executor.run_io(get_mtime, os.path.join(state.path, state.current))
+            if mtime is not None and mtime > state.last_write:
+                self.__on_modified(state, state.current, now)
+
+    async def __check_for_stale_outputs(self):
+        while True:
+            await asyncio.sleep(STALE_CHECK_SECS)
+            for state in self.states:
+                if state.stale_secs is None or state.is_stale or state.entries is None:
+                    continue
+                if state.secs_since_last_write() > state.stale_secs:
+                    state.is_stale = True
+                    if self.on_stale is not None:
+                        self.on_stale(state)
+
+
+# Modification time of a path (or None if it does not exist)
+def get_mtime(path):
+    try:
+        return os.stat(path).st_mtime
+    except FileNotFoundError:
+        return None
+
+
+# Modification time of a directory and of each file in it matching a pattern (blocking)
+def list_dir(path, pattern):
+    entries = {}
+    try:
+        dir_mtime = os.stat(path).st_mtime
+        with os.scandir(path) as it:
+            for entry in it:
+                if pattern.match(entry.name):
+                    try:
+                        entries[entry.name] = entry.stat().st_mtime
+                    except FileNotFoundError:
+                        pass  # Deleted while listing
+    except FileNotFoundError:
+        return None, entries
+    return dir_mtime, entries
@@ -0,0 +1,51 @@
+#!/usr/bin/env python3
+import argparse
+import subprocess
+import time
+
+import mp4box
+
+#
+# Benchmark the MP4 box scanner against the ffmpeg based check previously
+# used to find recordings that are missing the MOOV atom.
+#
+# Usage: bench_mp4box.py <file> [<file> ...]
+#
+
+CMD_CHECK_MOOV = 'ffmpeg -v trace -i %s 2>&1 | egrep -i "moov atom not found|invalid"'
+
+
+def check_with_ffmpeg(file):
+    process = subprocess.Popen(CMD_CHECK_MOOV % file, shell=True, stdout=subprocess.PIPE)
+    result = process.stdout.read()
+    process.wait()
+    return True if result else False
+
+
+def check_with_scanner(file):
+    return not mp4box.scan(file).is_complete()
+
+
+def time_check(check, file, repeat):
+    start = time.perf_counter()
+    for _ in range(repeat):
+        result = check(file)
+    return result, (time.perf_counter() - start) / repeat
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('files', nargs='+', help='MP4 files to check.')
+    parser.add_argument('-r', '--repeat', type=int, default=10, help='Number of times to check each file.')
+    args = parser.parse_args()
+
+    print(f'{"file":<40} {"ffmpeg":>12} {"scanner":>12} {"speedup":>10}  agree')
+    for file in args.files:
+        ffmpeg_result, ffmpeg_secs = time_check(check_with_ffmpeg, file, args.repeat)
+        scanner_result, scanner_secs = time_check(check_with_scanner, file, args.repeat)
+        print(f'{file[-40:]:<40} {ffmpeg_secs * 1000:>10.2f}ms {scanner_secs * 1000:>10.3f}ms '
+              f'{ffmpeg_secs / scanner_secs:>9.0f}x  {"yes" if ffmpeg_result == scanner_result else "NO"}')
+
+
+if __name__ == "__main__":
+    main()
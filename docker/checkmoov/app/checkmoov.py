@@ -1,14 +1,25 @@
 #!/usr/bin/env python3
 import subprocess
 import argparse
+import bisect
+import concurrent.futures
+import collections
 import logging
 from logging.handlers import RotatingFileHandler
 import shutil
 import time
-import json
 import sys
 import os
 import re
+import select
+
+import config
+import fastcopy
+import inotify
+import keyframes
+import mp4box
+import seekindex
+import segname
 
 #
 # Script (to be run as a service) to continually check for
@@ -30,81 +41,90 @@ import re
 
 UNTRUNC_BINARY       = 'untrunc'
 FFMPEG_BINARY        = 'ffmpeg'
-DATA_COPY_CHUNK_SIZE = 1024 * 1024 # Copy fixed data in 1Mb chunks
+IONICE_BINARY        = 'ionice'
+
+IO_PRIORITY_CLASSES = { 'realtime' : '1', 'best-effort' : '2', 'idle' : '3' }
+WORKER_NICENESS     = 10
+
+EVENT_WAIT_SECS     = 1        # Maximum time to wait for a recording to be closed
+WATCH_MASK          = inotify.IN_CLOSE_WRITE | inotify.IN_MOVED_TO | inotify.IN_ONLYDIR
 
 LOG_MAX_BYTES    = 262144
 LOG_BACKUP_COUNT = 2
 
 logger = logging.getLogger('check_moov_log')
 
-class CaptureConfig:
-
-    def __init__(self, config_file):
-        try:
-            with open(config_file) as f:
-                self.data = json.load(f)
-        except:
-            sys.exit('Unable to open JSON configuration.')
-
-        try:
-            self.capture_dir    = os.path.join(self.data['root_path'],
-                                               self.data['capture_dir'])
-            self.camera_names   = [x['name'] for x in self.data['cameras']]
-            self.log_file       = os.path.join(self.data['root_path'],
-                                               self.data['logs_dir'],
-                                               self.data['check_moov_log'])
-            self.check_interval = self.data['check_moov_interval_secs']
-        except KeyError:
-            sys.exit('Unable to read capture configuration.')
-
-    def getCaptureDir(self):
-        return self.capture_dir
-
-    def getCameraNames(self):
-        return self.camera_names
-
-    def getLogFile(self):
-        return self.log_file
-
-    def getCheckInterval(self):
-        return self.check_interval
-
 class CheckCamera:
     __MARKER_FILENAME = '.moov_check'
-    __CMD_CHECK_MOOV = FFMPEG_BINARY + ' -v trace -i %s 2>&1 | egrep -i "moov atom not found|invalid"'
     __CMD_FIX_MOOV = UNTRUNC_BINARY + ' %s %s'
     __CMD_FASTSTART = FFMPEG_BINARY + ' -i %s -c:a copy -c:v copy -movflags faststart %s'
     __MOOV_FIX_FILENAME = '%s_fixed.mp4'
     __FASTSTART_FILENAME = '%s_faststart.mp4'
 
-    def __init__(self, cam_dir):
+    def __init__(self, cam_dir, record_regex, max_bytes_per_sec=None, relocate_moov=False, seek_index=False,
+                 faststart_fmp4=False, files=None):
         self.cam_dir = cam_dir
+        self.record_regex = re.compile(record_regex) # Matches the recordings of the camera
+        self.max_bytes_per_sec = max_bytes_per_sec # Share of the disk bandwidth budget for copying data
+        self.relocate_moov = relocate_moov # Move the MOOV atom by patching offsets instead of using ffmpeg
+        self.seek_index = seek_index # Write a keyframe index alongside each checked recording
+        self.faststart_fmp4 = faststart_fmp4 # Convert fragmented recordings to fast start files
         self.good_file = None
         self.total_num_files = 0
         self.ignored_file = None
-        os.chdir(cam_dir)
+        self.fixed_files = []
+        self.is_time_named = False # Set if all recordings are named by their start time
 
-        files = self.__get_files_to_check()
+        if files is None: # Otherwise only check the given (closed) recordings
+            files = self.__get_files_to_check()
         for f in files:
-            if os.path.getsize(f) == 0:
+            try:
+                size = os.path.getsize(self.__path(f))
+            except FileNotFoundError:
+                continue # Already deleted to free up disk space
+            if size == 0:
                 continue # Ignore empty files
-            logging.info(f'Checking: {f}, size={os.path.getsize(f)} [total: {self.total_num_files} files]')
-            if self.__is_file_missing_moov(f):
+            logging.info(f'Checking: {f}, size={size} [total: {self.total_num_files} files]')
+            result = mp4box.scan(self.__path(f))
+            if result.is_fragmented():
+                if self.__check_fragmented(f, result):
+                    self.fixed_files.append(f)
+                if not self.faststart_fmp4 or mp4box.scan(self.__path(f)).is_fragmented():
+                    self.__write_check_marker(f)
+                    continue # Sample tables are held in each fragment so cannot be indexed
+            elif self.__is_file_missing_moov(f, result):
                 if not self.good_file:
                     self.good_file = self.__read_check_marker()
                 if not self.good_file: # Need at least one good file to fix anything
                     logging.warning(f'Unable to fix {f}. No good file to use.')
                     continue
+                if mp4box.scan(self.__path(self.good_file)).is_fragmented():
+                    logging.warning(f'Unable to fix {f}. Good file {self.good_file} is fragmented.')
+                    continue
                 if not self.__fix_moov(f):
                     logging.error(f'Failed to fix: {f}')
                     continue
+                self.fixed_files.append(f)
+            if self.seek_index:
+                self.__write_seek_index(f)
             self.__write_check_marker(f) # Update the check marker for any good file
 
+    def __path(self, filename):
+        return os.path.join(self.cam_dir, filename)
+
+    def __run(self, cmd):
+        # Run in the camera directory so that commands can be given (and create) plain filenames
+        subprocess.call(cmd, shell=True, cwd=self.cam_dir, stdout=subprocess.DEVNULL, stderr=subprocess.STDOUT)
+
     def __get_all_files(self):
-        files = [f for f in os.listdir('.') if re.match('^[a-zA-Z0-9_\-]+_\d+\.mp4$', f, re.IGNORECASE)]
+        files = [f for f in os.listdir(self.cam_dir) if self.record_regex.match(f)]
         self.total_num_files = len(files)
-        files.sort(key=lambda x: os.path.getmtime(x))
-        self.__check_order_of_last_two_files(files)
+        self.is_time_named = all(segname.get_start_time(f) is not None for f in files)
+        if self.is_time_named:
+            files.sort() # Names sort in the order the recordings were made
+        else:
+            files.sort(key=lambda x: os.path.getmtime(self.__path(x)))
+            self.__check_order_of_last_two_files(files)
         if len(files):
             self.ignored_file = files.pop() # Remove the most recent recording (which might be active)
         return files
@@ -136,6 +156,9 @@ class CheckCamera:
         if not marker:
             # No check marker so return all files to check
             return files
+        if self.is_time_named and segname.get_start_time(marker) is not None:
+            # Every recording made after the marked one (even if the marked one has since been deleted)
+            return files[bisect.bisect_right(files, marker):]
         try:
             i = files.index(marker)
             return files[i+1:]
@@ -146,34 +169,63 @@ class CheckCamera:
             logging.error(','.join(files))
             return files
 
-    def __is_file_missing_moov(self, file):
-        process = subprocess.Popen(self.__CMD_CHECK_MOOV % file, shell=True, stdout=subprocess.PIPE)
-        result = process.stdout.read()
-        return True if result else False
-
-    def __fix_moov(self, bad_file):
-        # Step 1: Cleanup any temporary files left over from a previously interrupted fix attempt
+    def __is_file_missing_moov(self, file, result):
+        if not result.is_complete():
+            logging.info(f'{file} is {result.status.replace("_", " ")} [boxes: {result.boxes}]')
+            return True
+        return False
+
+    def __check_fragmented(self, file, result):
+        # A fragmented recording is playable up to its last complete fragment so never needs
+        # a MOOV atom adding. Only a fragment that was still being written has to be removed.
+        last_access_time   = os.path.getatime(self.__path(file))
+        last_modified_time = os.path.getmtime(self.__path(file))
+        is_changed = False
+
+        fragments_end = result.get_fragments_end()
+        if fragments_end < result.file_size:
+            logging.info(f'Removing incomplete fragment from {file} ({result.file_size - fragments_end} bytes)')
+            os.truncate(self.__path(file), fragments_end)
+            is_changed = True
+
+        if self.faststart_fmp4:
+            self.__cleanup_temp_files()
+            if self.__replace_with_faststart(file, file):
+                is_changed = True
+            else:
+                logging.error(f'Failed to convert {file} to a fast start file.')
+
+        if is_changed: # Maintain the original last modified time (see __fix_moov)
+            os.utime(self.__path(file), (last_access_time, last_modified_time))
+        return is_changed
+
+    def __cleanup_temp_files(self):
+        # Cleanup any temporary files left over from a previously interrupted fix attempt
         for pattern in [self.__MOOV_FIX_FILENAME, self.__FASTSTART_FILENAME]:
             regex = rf'{re.escape(pattern) % ".*"}'
-            files_to_cleanup = [f for f in os.listdir('.') if re.match(regex, f)]
+            files_to_cleanup = [f for f in os.listdir(self.cam_dir) if re.match(regex, f)]
             for f in files_to_cleanup:
                 logging.warning(f'Cleaning up {f}')
-                os.remove(f)
+                os.remove(self.__path(f))
+
+    def __fix_moov(self, bad_file):
+        # Step 1: Cleanup any temporary files left over from a previously interrupted fix attempt
+        self.__cleanup_temp_files()
 
         # Step 2: Add the missing MOOV atom for the supplied file
-        subprocess.call(self.__CMD_FIX_MOOV % (self.good_file, bad_file), shell=True, stdout=subprocess.DEVNULL, stderr=subprocess.STDOUT)
+        self.__run(self.__CMD_FIX_MOOV % (self.good_file, bad_file))
         fixed_file = self.__MOOV_FIX_FILENAME % bad_file
 
-        if not os.path.isfile(fixed_file):
+        if not os.path.isfile(self.__path(fixed_file)):
             logging.error(f'Failed to create {fixed_file} with MOOV atom.')
             # A bit draconian and this is very rare, but it is possible that the good file contains
             # a MOOV atom but it is too small to be of any use so remove it and rebuild check marker
-            os.remove(self.good_file)
-            os.remove(self.__MARKER_FILENAME)
+            os.remove(self.__path(self.good_file))
+            os.remove(self.__path(self.__MARKER_FILENAME))
             return False
 
-        bad_file_size   = os.path.getsize(bad_file)
-        fixed_file_size = os.path.getsize(fixed_file)
+        bad_file_size   = os.path.getsize(self.__path(bad_file))
+        fixed_file_size = os.path.getsize(self.__path(fixed_file))
 
         if fixed_file_size == 0: # Sanity check
             logging.error(f'Size of {fixed_file} is zero. Aborting fix.')
@@ -183,72 +235,266 @@ class CheckCamera:
             logging.warning(f'Fixed file is smaller than original: {fixed_file}, {bad_file}')
             logging.warning(f'Fixed vs original file sizes: {fixed_file_size} bytes, {bad_file_size} bytes ({bad_file_size - fixed_file_size} bytes lost)')
 
-        # Step 3: Move the MOOV atom to the beginning of the file to create a fast start file
-        faststart_file = self.__FASTSTART_FILENAME % bad_file
-        if os.path.isfile(faststart_file): # Command will fail if output file already exists
-            os.remove(faststart_file)
-        subprocess.call(self.__CMD_FASTSTART % (fixed_file, faststart_file), shell=True, stdout=subprocess.DEVNULL, stderr=subprocess.STDOUT)
-
-        os.remove(fixed_file) # Clean up the initial fixed file
-
-        if not os.path.isfile(faststart_file):
-            logging.error(f'Failed to create {faststart_file} with faststart.')
-            return False
-
-        # Step 4: Maintain the creation time and the last modified time of the original file with fixed data
-        last_access_time   = os.path.getatime(bad_file)
-        last_modified_time = os.path.getmtime(bad_file)
+        # Step 3: Maintain the creation time and the last modified time of the original file with fixed data
+        last_access_time   = os.path.getatime(self.__path(bad_file))
+        last_modified_time = os.path.getmtime(self.__path(bad_file))
 
         # It is important to maintain the original file creation time and last modified time
         # so that we can determine the duration of any video file efficiently by subtracting
-        # the creation time from the last modified time. So truncate the original bad file
-        # to zero bytes and replace its contents with data from the fast start file.
-        with open(faststart_file, 'rb') as src:
-            with open(bad_file, 'ab') as dest:
-                dest.truncate(0)
-                while True:
-                    data = src.read(DATA_COPY_CHUNK_SIZE)
-                    if not data:
-                        break
-                    dest.write(data)
-
-        os.remove(faststart_file) # Clean up the fast start file
+        # the creation time from the last modified time. So the contents of the original bad
+        # file are replaced rather than the file itself.
+        if not self.relocate_moov or not self.__relocate_moov(fixed_file, bad_file):
+            # Step 4: Move the MOOV atom to the beginning of the file to create a fast start file
+            if not self.__replace_with_faststart(fixed_file, bad_file):
+                os.remove(self.__path(fixed_file))
+                return False
+
+        os.remove(self.__path(fixed_file)) # Clean up the initial fixed file
 
         # Then re-apply the original last modified time (and last access time)
-        os.utime(bad_file, (last_access_time, last_modified_time))
+        os.utime(self.__path(bad_file), (last_access_time, last_modified_time))
 
-        fixed_file_size = os.path.getsize(bad_file)
+        fixed_file_size = os.path.getsize(self.__path(bad_file))
         logging.info(f'Fixed: {bad_file} (size: {fixed_file_size}), ignored={self.ignored_file}')
         return True
 
+    def __replace_with_faststart(self, src_file, dest_file):
+        faststart_file = self.__FASTSTART_FILENAME % dest_file
+        if os.path.isfile(self.__path(faststart_file)): # Command will fail if output file already exists
+            os.remove(self.__path(faststart_file))
+        self.__run(self.__CMD_FASTSTART % (src_file, faststart_file))
+
+        if not os.path.isfile(self.__path(faststart_file)):
+            logging.error(f'Failed to create {faststart_file} with faststart.')
+            return False
+
+        start_time = time.monotonic()
+        method = fastcopy.replace_contents(self.__path(faststart_file), self.__path(dest_file),
+                                           lambda n: self.__throttle(start_time, n))
+        logging.info(f'Copied {faststart_file} to {dest_file} using {method}')
+        os.remove(self.__path(faststart_file)) # Clean up the fast start file
+        return True
+
+    def __relocate_moov(self, fixed_file, bad_file):
+        # Write the fixed file into the original with the MOOV atom moved to the beginning by
+        # patching the chunk offsets it holds, which avoids writing another copy with ffmpeg
+        layout = mp4box.build_faststart_layout(self.__path(fixed_file))
+        if layout is None:
+            logging.info(f'Unable to relocate MOOV atom of {fixed_file} in place. Using ffmpeg.')
+            return False
+        header, ranges = layout
+
+        src_fd = os.open(self.__path(fixed_file), os.O_RDONLY)
+        try:
+            dest_fd = os.open(self.__path(bad_file), os.O_WRONLY)
+            try:
+                os.ftruncate(dest_fd, 0)
+                os.pwrite(dest_fd, header, 0)
+                start_time, dest_offset = time.monotonic(), len(header)
+                for src_offset, size in ranges:
+                    copied = dest_offset
+                    method = fastcopy.copy_range(src_fd, dest_fd, src_offset, dest_offset, size,
+                                                 lambda n: self.__throttle(start_time, copied + n))
+                    dest_offset += size
+            finally:
+                os.close(dest_fd)
+        finally:
+            os.close(src_fd)
+
+        logging.info(f'Relocated MOOV atom of {fixed_file} into {bad_file} using {method if ranges else "write"}')
+        return True
+
+    def __throttle(self, start_time, bytes_copied):
+        # Sleep for long enough to keep within this camera's share of the disk bandwidth budget
+        if not self.max_bytes_per_sec:
+            return
+        ahead_secs = bytes_copied / self.max_bytes_per_sec - (time.monotonic() - start_time)
+        if ahead_secs > 0:
+            time.sleep(ahead_secs)
+
+    def __write_seek_index(self, file):
+        try:
+            index = keyframes.build(self.__path(file))
+        except Exception:
+            logging.exception(f'Failed to read sample tables of {file}')
+            return
+        if index is None:
+            logging.warning(f'Unable to index {file}. No video track found.')
+            return
+        seekindex.write(self.__path(file), index)
+
     def __write_check_marker(self, file):
-        with open(self.__MARKER_FILENAME, 'w') as f:
+        with open(self.__path(self.__MARKER_FILENAME), 'w') as f:
             f.write(file)
             f.flush()
             os.fsync(f.fileno())
 
     def __read_check_marker(self):
         try:
-            with open(self.__MARKER_FILENAME, 'r') as f:
+            with open(self.__path(self.__MARKER_FILENAME), 'r') as f:
                 return f.read().strip()
         except:
             return None
 
+def init_worker(io_priority):
+    # Lower the CPU and I/O priority of the worker (inherited by untrunc and ffmpeg)
+    # so that repairs do not starve the recordings being written to the same disk
+    os.nice(WORKER_NICENESS)
+    if shutil.which(IONICE_BINARY):
+        subprocess.call([IONICE_BINARY, '-c', IO_PRIORITY_CLASSES[io_priority], '-p', str(os.getpid())])
+    else:
+        logging.warning(f'Cannot find {IONICE_BINARY}. I/O priority is unchanged.')
+
+def check_camera(cam_dir, record_regex, max_bytes_per_sec, relocate_moov, seek_index, faststart_fmp4, files=None):
+    try:
+        checker = CheckCamera(cam_dir, record_regex, max_bytes_per_sec, relocate_moov, seek_index, faststart_fmp4,
+                              files)
+        return checker.fixed_files, checker.ignored_file
+    except Exception:
+        logging.exception(f'Failed to check {cam_dir}')
+        return [], None
+
 class CheckAllCameras:
 
-    def __init__(self, config):
-        self.capture_dir = config.getCaptureDir()
-        self.camera_names = config.getCameraNames()
+    def __init__(self, cfg):
+        self.capture_dir = cfg.capture_path
+        self.camera_names = cfg.get_camera_names()
+        self.record_regexes = {cam : cfg.get_camera(cam).record_regex for cam in self.camera_names}
+        self.workers = cfg.check_moov_workers
+        self.relocate_moov = cfg.check_moov_relocate_moov
+        self.seek_index = cfg.check_moov_seek_index
+        self.faststart_fmp4 = cfg.check_moov_faststart_fmp4
+
+        # Each worker gets an equal share of the aggregate disk bandwidth budget
+        max_mb_per_sec = cfg.check_moov_max_mb_per_sec
+        self.max_bytes_per_sec = (max_mb_per_sec * 1024 * 1024) / self.workers if max_mb_per_sec else None
+
+        # Cameras are checked concurrently but each camera is only ever checked by one worker at a time
+        self.pool = concurrent.futures.ProcessPoolExecutor(max_workers=self.workers,
+                                                           initializer=init_worker,
+                                                           initargs=(cfg.check_moov_io_priority,))
 
     def run(self):
+        futures = []
         for cam in self.camera_names:
             cam_dir = os.path.join(self.capture_dir, cam)
             if not os.path.isdir(cam_dir):
                 continue
-            CheckCamera(cam_dir)
+            futures.append(self.pool.submit(check_camera, cam_dir, self.record_regexes[cam], self.max_bytes_per_sec,
+                                            self.relocate_moov, self.seek_index, self.faststart_fmp4))
+        concurrent.futures.wait(futures)
+
+class CameraQueue:
+
+    def __init__(self, cam_dir, record_regex):
+        self.cam_dir = cam_dir
+        self.record_regex = record_regex         # Pattern matching the recordings of the camera
+        self.wd = None
+        self.pending = collections.OrderedDict() # Closed recordings waiting to be checked (in order)
+        self.needs_sweep = True                  # Catch up from the check marker (e.g. after a restart)
+        self.future = None                       # Check in progress for this camera
+        self.deferred = None                     # Most recent recording skipped by a sweep
+
+    def add(self, filename):
+        # Any recording closing means that the one skipped by the last sweep (in case it was
+        # still being written) is finished with, whether or not it is the one closing
+        if self.deferred is not None:
+            self.pending[self.deferred] = None
+            self.deferred = None
+        self.pending[filename] = None
+
+    def defer(self, filename):
+        if self.pending: # Already finished with as a more recent recording has closed
+            self.pending[filename] = None
+            self.pending.move_to_end(filename, last=False)
+        else:
+            self.deferred = filename
+
+class WatchAllCameras:
+
+    def __init__(self, cfg):
+        self.capture_dir = cfg.capture_path
+        self.workers = cfg.check_moov_workers
+        self.relocate_moov = cfg.check_moov_relocate_moov
+        self.seek_index = cfg.check_moov_seek_index
+        self.faststart_fmp4 = cfg.check_moov_faststart_fmp4
+
+        max_mb_per_sec = cfg.check_moov_max_mb_per_sec
+        self.max_bytes_per_sec = (max_mb_per_sec * 1024 * 1024) / self.workers if max_mb_per_sec else None
+
+        self.inotify = inotify.Inotify()
+        self.cameras = [CameraQueue(os.path.join(self.capture_dir, cam), cfg.get_camera(cam).record_regex)
+                        for cam in cfg.get_camera_names()]
+        self.wds = {} # Watch descriptor -> CameraQueue
+
+        self.pool = concurrent.futures.ProcessPoolExecutor(max_workers=self.workers,
+                                                           initializer=init_worker,
+                                                           initargs=(cfg.check_moov_io_priority,))
+
+    def run(self):
+        while True:
+            self.__add_watches()
+            readable, _, _ = select.select([self.inotify.fileno()], [], [], EVENT_WAIT_SECS)
+            if readable:
+                self.__read_events()
+            self.__collect_results()
+            self.__submit_checks()
+
+    def __add_watches(self):
+        # Camera directories are only created once recording starts so keep trying until they exist
+        for cam in self.cameras:
+            if cam.wd is None and os.path.isdir(cam.cam_dir):
+                cam.wd = self.inotify.add_watch(cam.cam_dir, WATCH_MASK)
+                self.wds[cam.wd] = cam
+                cam.needs_sweep = True # Check anything closed before the watch was added
+
+    def __read_events(self):
+        for wd, mask, filename in self.inotify.read_events():
+            if mask & inotify.IN_Q_OVERFLOW:
+                logging.warning('inotify event queue overflowed. Checking all cameras from their check markers.')
+                for cam in self.cameras:
+                    cam.needs_sweep = True
+                continue
+            cam = self.wds.get(wd)
+            if cam is None:
+                continue
+            if mask & inotify.IN_IGNORED: # Camera directory removed
+                del self.wds[wd]
+                cam.wd = None
+            elif re.match(cam.record_regex, filename):
+                cam.add(filename)
+
+    def __collect_results(self):
+        done = [cam for cam in self.cameras if cam.future is not None and cam.future.done()]
+        if not done:
+            return
+        # Any close caused by writing the data of a fixed recording happened before its check
+        # completed, so read outstanding events now in order to ignore them
+        self.__read_events()
+        for cam in done:
+            fixed_files, ignored_file = cam.future.result()
+            for filename in fixed_files:
+                cam.pending.pop(filename, None)
+            if ignored_file is not None:
+                cam.defer(ignored_file)
+            cam.future = None
+
+    def __submit_checks(self):
+        for cam in self.cameras:
+            if cam.future is not None or cam.wd is None:
+                continue # Each camera is only ever checked by one worker at a time
+            if cam.needs_sweep:
+                files, cam.needs_sweep = None, False
+            elif cam.pending:
+                files = list(cam.pending)
+                cam.pending.clear()
+            else:
+                continue
+            cam.future = self.pool.submit(check_camera, cam.cam_dir, cam.record_regex, self.max_bytes_per_sec,
+                                          self.relocate_moov, self.seek_index, self.faststart_fmp4, files)
 
-def configure_logging(config):
-    log_file = config.getLogFile()
+def configure_logging(cfg):
+    log_file = cfg.check_moov_log_file
 
     if not os.path.exists(os.path.dirname(log_file)):
         os.makedirs(os.path.dirname(log_file))
@@ -268,12 +514,17 @@ def configure_logging(config):
     except PermissionError:
         print(f'Cannot open log file ({log_file}). Logging is disabled.')
 
-def checkmoov(config):
+def checkmoov(cfg):
     logging.info('Starting...')
 
-    scanner = CheckAllCameras(config)
+    if cfg.check_moov_mode == config.CHECK_MODE_EVENT:
+        if inotify.is_supported():
+            WatchAllCameras(cfg).run()
+        logging.warning('inotify is not available. Falling back to polling for recordings to check.')
+
+    scanner = CheckAllCameras(cfg)
     while True:
-        time.sleep(config.getCheckInterval())
+        time.sleep(cfg.check_moov_interval_secs)
         scanner.run()
 
 def main():
@@ -286,11 +537,15 @@ def main():
     parser.add_argument('config_file', help='CCTV JSON configuration file.')
     args = parser.parse_args()
 
-    config = CaptureConfig(args.config_file)
-    configure_logging(config)
+    try:
+        cfg = config.load(args.config_file)
+    except config.ConfigError as e:
+        sys.exit(f'Invalid configuration: {e}')
+
+    configure_logging(cfg)
 
     try:
-        checkmoov(config)
+        checkmoov(cfg)
     except Exception:
         logger.exception('Fatal error in main loop')
 
@@ -0,0 +1,91 @@
+import errno
+import fcntl
+import os
+
+#
+# Copy file data without passing it through userspace where possible: by sharing
+# the data blocks (reflink) on filesystems that support it (e.g. btrfs, XFS), else
+# with copy_file_range or sendfile so that the kernel does the copying.
+#
+
+FICLONE         = 0x40049409       # ioctl to share all data blocks of one file with another
+COPY_CHUNK_SIZE = 8 * 1024 * 1024  # Copy in chunks so that copying can be throttled
+
+# Errors meaning that a method of copying is not supported for the given files
+UNSUPPORTED_ERRNOS = { errno.EXDEV, errno.ENOSYS, errno.EINVAL, errno.EOPNOTSUPP, errno.ENOTTY, errno.EBADF }
+
+
+def clone(src_fd, dest_fd):
+    try:
+        fcntl.ioctl(dest_fd, FICLONE, src_fd)
+        return True
+    except OSError as e:
+        if e.errno in UNSUPPORTED_ERRNOS:
+            return False
+        raise
+
+
+def copy_range(src_fd, dest_fd, src_offset, dest_offset, length, throttle=None):
+    for method in (copy_file_range, sendfile, read_write):
+        try:
+            return method(src_fd, dest_fd, src_offset, dest_offset, length, throttle)
+        except OSError as e:
+            if e.errno not in UNSUPPORTED_ERRNOS:
+                raise
+            # Nothing is copied before a method is found to be unsupported
+
+
+# Replace the contents of the destination file (keeping the same inode and therefore its
+# creation time) with the source file. Returns the name of the method used.
+def replace_contents(src_path, dest_path, throttle=None):
+    src_fd = os.open(src_path, os.O_RDONLY)
+    try:
+        dest_fd = os.open(dest_path, os.O_WRONLY)
+        try:
+            os.ftruncate(dest_fd, 0)
+            if clone(src_fd, dest_fd):
+                return 'reflink'
+            return copy_range(src_fd, dest_fd, 0, 0, os.fstat(src_fd).st_size, throttle)
+        finally:
+            os.close(dest_fd)
+    finally:
+        os.close(src_fd)
+
+
+def copy_file_range(src_fd, dest_fd, src_offset, dest_offset, length, throttle):
+    copied = 0
+    while copied < length:
+        n = os.copy_file_range(src_fd, dest_fd, min(COPY_CHUNK_SIZE, length - copied),
+                               src_offset + copied, dest_offset + copied)
+        if n == 0:
+            break
+        copied += n
+        if throttle:
+            throttle(copied)
+    return 'copy_file_range'
+
+
+def sendfile(src_fd, dest_fd, src_offset, dest_offset, length, throttle):
+    copied = 0
+    os.lseek(dest_fd, dest_offset, os.SEEK_SET)
+    while copied < length:
+        n = os.sendfile(dest_fd, src_fd, src_offset + copied, min(COPY_CHUNK_SIZE, length - copied))
+        if n == 0:
+            break
+        copied += n
+        if throttle:
+            throttle(copied)
+    return 'sendfile'
+
+
+def read_write(src_fd, dest_fd, src_offset, dest_offset, length, throttle):
+    copied = 0
+    while copied < length:
+        data = os.pread(src_fd, min(COPY_CHUNK_SIZE, length - copied), src_offset + copied)
+        if not data:
+            break
+        os.pwrite(dest_fd, data, dest_offset + copied)
+        copied += len(data)
+        if throttle:
+            throttle(copied)
+    return 'read/write'
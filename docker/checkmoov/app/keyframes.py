@@ -0,0 +1,139 @@
+import itertools
+import os
+import struct
+
+import mp4box
+import seekindex
+
+#
+# Build the seek index of a complete recording from the sample tables of its video
+# track (only the moov box is read).
+#
+
+FULL_BOX_HEADER_SIZE = 4  # version, flags
+VISUAL_ENTRY_SIZE    = struct.Struct('>HH')  # width, height
+VISUAL_ENTRY_OFFSET  = 32  # Offset of the width/height in a visual sample entry
+
+
+def build(path):
+    moov = mp4box.read_moov(path)
+    if moov is None:
+        return None
+    data, moov_box = moov
+
+    for trak in mp4box.find_children(data, moov_box, 'trak'):
+        mdia = mp4box.find_child(data, trak, 'mdia')
+        hdlr = mp4box.find_child(data, mdia, 'hdlr') if mdia else None
+        if hdlr is not None and read_handler_type(data, hdlr) == 'vide':
+            return build_from_track(path, data, trak, mdia)
+    return None
+
+
+def build_from_track(path, data, trak, mdia):
+    minf = mp4box.find_child(data, mdia, 'minf')
+    stbl = mp4box.find_child(data, minf, 'stbl') if minf else None
+    mdhd = mp4box.find_child(data, mdia, 'mdhd')
+    if stbl is None or mdhd is None:
+        return None
+    boxes = { box.type : box for box in mp4box.parse_boxes(data, stbl.data_offset, stbl.end) }
+    if not all(box_type in boxes for box_type in ('stsd', 'stts', 'stsc', 'stsz')):
+        return None
+    if 'stco' not in boxes and 'co64' not in boxes:
+        return None
+
+    timescale, duration = read_mdhd(data, mdhd)
+    if not timescale:
+        return None
+    codec, width, height = read_stsd(data, boxes['stsd'])
+
+    sizes = read_stsz(data, boxes['stsz'])
+    decode_times = [0] + list(itertools.accumulate(expand(read_table(data, boxes['stts'], '>II'))))
+    composition_offsets = expand(read_table(data, boxes['ctts'], '>Ii' if data[boxes['ctts'].data_offset] else '>II')) \
+                          if 'ctts' in boxes else None
+    sync_samples = set(n - 1 for n, in read_table(data, boxes['stss'], '>I')) if 'stss' in boxes else None
+    start_offset = read_edit_start(data, trak)
+
+    if 'stco' in boxes:
+        chunk_offsets = [offset for offset, in read_table(data, boxes['stco'], '>I')]
+    else:
+        chunk_offsets = [offset for offset, in read_table(data, boxes['co64'], '>Q')]
+
+    # Walk the samples chunk by chunk to find the byte offset of every keyframe
+    keyframes = []
+    sample_to_chunk = read_table(data, boxes['stsc'], '>III')
+    sample = 0
+    for i, (first_chunk, samples_per_chunk, _) in enumerate(sample_to_chunk):
+        last_chunk = sample_to_chunk[i + 1][0] - 1 if i + 1 < len(sample_to_chunk) else len(chunk_offsets)
+        for chunk in range(first_chunk, last_chunk + 1):
+            offset = chunk_offsets[chunk - 1]
+            for _ in range(samples_per_chunk):
+                if sample >= len(sizes):
+                    break
+                if sync_samples is None or sample in sync_samples:
+                    time = decode_times[sample] - start_offset
+                    if composition_offsets is not None and sample < len(composition_offsets):
+                        time += composition_offsets[sample]
+                    keyframes.append((max(0, time * 1000 // timescale), offset))
+                offset += sizes[sample]
+                sample += 1
+    keyframes.sort()
+
+    stat = os.stat(path)
+    duration_secs = duration / timescale
+    bitrate = int(stat.st_size * 8 / duration_secs) if duration_secs else 0
+    # The recording started its duration before it was last modified (as used for playback)
+    return seekindex.SeekIndex(stat.st_size, stat.st_mtime - duration_secs, duration_secs, codec,
+                               width, height, bitrate, keyframes)
+
+
+def read_handler_type(data, hdlr):
+    offset = hdlr.data_offset + FULL_BOX_HEADER_SIZE + 4  # Skip pre_defined
+    return data[offset:offset + 4].decode('latin-1')
+
+
+def read_mdhd(data, mdhd):
+    offset = mdhd.data_offset
+    if data[offset] == 1:  # Version 1 has 64-bit times
+        return struct.unpack_from('>IQ', data, offset + FULL_BOX_HEADER_SIZE + 16)
+    return struct.unpack_from('>II', data, offset + FULL_BOX_HEADER_SIZE + 8)
+
+
+def read_stsd(data, stsd):
+    entry_offset = stsd.data_offset + FULL_BOX_HEADER_SIZE + 4  # Skip entry count
+    codec = data[entry_offset + 4:entry_offset + 8].decode('latin-1')
+    width, height = VISUAL_ENTRY_SIZE.unpack_from(data, entry_offset + VISUAL_ENTRY_OFFSET)
+    return codec, width, height
+
+
+def read_stsz(data, stsz):
+    sample_size, num_samples = struct.unpack_from('>II', data, stsz.data_offset + FULL_BOX_HEADER_SIZE)
+    if sample_size:
+        return [sample_size] * num_samples
+    return list(struct.unpack_from(f'>{num_samples}I', data, stsz.data_offset + FULL_BOX_HEADER_SIZE + 8))
+
+
+# Read the entries of a full box that holds an entry count followed by the entries
+def read_table(data, box, entry_format):
+    offset = box.data_offset + FULL_BOX_HEADER_SIZE
+    num_entries, = struct.unpack_from('>I', data, offset)
+    entry = struct.Struct(entry_format)
+    num_entries = min(num_entries, (box.end - offset - 4) // entry.size)  # Guard against corrupt counts
+    return [entry.unpack_from(data, offset + 4 + i * entry.size) for i in range(num_entries)]
+
+
+# Expand a table of (count, value) runs into a list of values
+def expand(runs):
+    return list(itertools.chain.from_iterable(itertools.repeat(value, count) for count, value in runs))
+
+
+# Media time at which presentation starts according to the edit list (if any)
+def read_edit_start(data, trak):
+    edts = mp4box.find_child(data, trak, 'edts')
+    elst = mp4box.find_child(data, edts, 'elst') if edts else None
+    if elst is None:
+        return 0
+    entry_format = '>Qq' if data[elst.data_offset] == 1 else '>Ii'
+    for _, media_time in read_table(data, elst, entry_format):
+        if media_time >= 0:  # Skip empty edits
+            return media_time
+    return 0
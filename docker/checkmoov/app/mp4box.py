@@ -0,0 +1,251 @@
+import os
+import struct
+
+#
+# Minimal MP4 (ISO BMFF) box walker that only reads box headers so that a
+# recording can be classified without parsing (or even reading) its media data.
+#
+
+COMPLETE     = 'complete'      # All top level boxes are intact and a moov box is present
+MISSING_MOOV = 'missing_moov'  # No moov box (e.g. the recording was never finalised)
+TRUNCATED    = 'truncated'     # A box extends beyond the end of the file or is malformed
+
+BOX_HEADER        = struct.Struct('>I4s')  # size, type
+LARGE_SIZE        = struct.Struct('>Q')    # 64-bit size following the header when size == 1
+BOX_HEADER_SIZE   = BOX_HEADER.size
+LARGE_HEADER_SIZE = BOX_HEADER_SIZE + LARGE_SIZE.size
+
+
+class Box:
+    __slots__ = ('type', 'offset', 'size', 'header_size')
+
+    def __init__(self, box_type, offset, size, header_size):
+        self.type        = box_type
+        self.offset      = offset       # Offset of the box header
+        self.size        = size         # Total size including the header
+        self.header_size = header_size
+
+    @property
+    def end(self):
+        return self.offset + self.size
+
+    @property
+    def data_offset(self):
+        return self.offset + self.header_size
+
+    def __repr__(self):
+        return f'Box({self.type}, offset={self.offset}, size={self.size})'
+
+
+class ScanResult:
+    def __init__(self, status, boxes, file_size, is_intact=True, is_last_partial=False):
+        self.status          = status
+        self.boxes           = boxes            # Top level boxes in file order
+        self.file_size       = file_size
+        self.is_intact       = is_intact        # Otherwise the file ends with an incomplete box (or header)
+        self.is_last_partial = is_last_partial  # Set if the last box in boxes is incomplete
+
+    def find(self, box_type):
+        for box in self.boxes:
+            if box.type == box_type:
+                return box
+        return None
+
+    def is_complete(self):
+        return self.status == COMPLETE
+
+    # Fragmented recordings hold their samples in moof boxes (each followed by an mdat box)
+    def is_fragmented(self):
+        return self.find('moof') is not None
+
+    # End of the last complete fragment, i.e. the size of the file with any fragment that
+    # was still being written when the recording stopped removed
+    def get_fragments_end(self):
+        end = 0
+        for box in self.boxes[:-1] if self.is_last_partial else self.boxes:
+            if box.type != 'moof':  # Only complete once its mdat box has been written
+                end = box.end
+        return end
+
+
+# Read the header of the box at the given offset. Returns None if the header is incomplete.
+def read_box_header(fd, offset, end):
+    if end - offset < BOX_HEADER_SIZE:
+        return None
+    size, box_type = BOX_HEADER.unpack(os.pread(fd, BOX_HEADER_SIZE, offset))
+    box_type = box_type.decode('latin-1')
+    header_size = BOX_HEADER_SIZE
+    if size == 1:  # 64-bit largesize
+        if end - offset < LARGE_HEADER_SIZE:
+            return None
+        size, = LARGE_SIZE.unpack(os.pread(fd, LARGE_SIZE.size, offset + BOX_HEADER_SIZE))
+        header_size = LARGE_HEADER_SIZE
+    elif size == 0:  # Box extends to the end of the file
+        size = end - offset
+    return Box(box_type, offset, size, header_size)
+
+
+# Walk the boxes between start and end. Returns the boxes, whether they were all intact and
+# whether the last box returned is incomplete (an incomplete header is not returned as a box).
+def read_boxes(fd, start, end):
+    boxes, offset = [], start
+    while offset < end:
+        box = read_box_header(fd, offset, end)
+        if box is None:
+            return boxes, False, False
+        if box.size < box.header_size or box.end > end:
+            boxes.append(box)
+            return boxes, False, True
+        boxes.append(box)
+        offset = box.end
+    return boxes, True, False
+
+
+def scan(path):
+    fd = os.open(path, os.O_RDONLY)
+    try:
+        file_size = os.fstat(fd).st_size
+        boxes, is_intact, is_last_partial = read_boxes(fd, 0, file_size)
+    finally:
+        os.close(fd)
+
+    if not any(box.type == 'moov' for box in boxes):
+        status = MISSING_MOOV
+    elif not is_intact:
+        status = TRUNCATED
+    else:
+        status = COMPLETE
+    return ScanResult(status, boxes, file_size, is_intact, is_last_partial)
+
+
+#
+# Relocation of the moov box to the start of a file (i.e. faststart) by patching the
+# chunk offsets held in its stco/co64 boxes rather than remuxing the whole file.
+#
+
+CHUNK_OFFSET_CONTAINERS = { 'moov', 'trak', 'mdia', 'minf', 'stbl' }  # Boxes on the path to stco/co64
+FULL_BOX_HEADER         = struct.Struct('>II')  # version/flags, entry count
+MAX_32BIT_OFFSET        = 0xFFFFFFFF
+
+
+# Parse child boxes from the given data (offsets are relative to the data)
+def parse_boxes(data, start, end):
+    boxes, offset = [], start
+    while end - offset >= BOX_HEADER_SIZE:
+        size, box_type = BOX_HEADER.unpack_from(data, offset)
+        header_size = BOX_HEADER_SIZE
+        if size == 1:
+            size, = LARGE_SIZE.unpack_from(data, offset + BOX_HEADER_SIZE)
+            header_size = LARGE_HEADER_SIZE
+        elif size == 0:
+            size = end - offset
+        if size < header_size or offset + size > end:
+            break
+        boxes.append(Box(box_type.decode('latin-1'), offset, size, header_size))
+        offset += size
+    return boxes
+
+
+def find_child(data, box, box_type):
+    for child in parse_boxes(data, box.data_offset, box.end):
+        if child.type == box_type:
+            return child
+    return None
+
+
+def find_children(data, box, box_type):
+    return [child for child in parse_boxes(data, box.data_offset, box.end) if child.type == box_type]
+
+
+# Read the whole moov box of a complete file. Returns the data and a box for the moov
+# with offsets relative to the data, or None if the file is not complete.
+def read_moov(path):
+    result = scan(path)
+    moov = result.find('moov')
+    if not result.is_complete() or moov is None:
+        return None
+    fd = os.open(path, os.O_RDONLY)
+    try:
+        data = os.pread(fd, moov.size, moov.offset)
+    finally:
+        os.close(fd)
+    return data, Box('moov', 0, len(data), moov.header_size)
+
+
+# Duration in seconds of a complete file from its movie header (or None if it is not known)
+def get_duration(path):
+    moov = read_moov(path)
+    if moov is None:
+        return None
+    data, moov_box = moov
+    mvhd = find_child(data, moov_box, 'mvhd')
+    if mvhd is None:
+        return None
+    offset = mvhd.data_offset + 4  # Skip version/flags
+    if data[mvhd.data_offset] == 1:  # Version 1 has 64-bit times
+        timescale, duration = struct.unpack_from('>IQ', data, offset + 16)
+    else:
+        timescale, duration = struct.unpack_from('>II', data, offset + 8)
+    if not timescale or not duration:  # e.g. a fragmented file
+        return None
+    return duration / timescale
+
+
+def find_chunk_offset_boxes(data, start, end):
+    found = []
+    for box in parse_boxes(data, start, end):
+        if box.type in ('stco', 'co64'):
+            found.append(box)
+        elif box.type in CHUNK_OFFSET_CONTAINERS:
+            found.extend(find_chunk_offset_boxes(data, box.data_offset, box.end))
+    return found
+
+
+# Work out how to lay out the given (complete) file with its moov box first. Returns the
+# bytes to write at the start of the new file (ftyp and the patched moov) and the list
+# of (offset, size) ranges of the original file to copy after them, or None if the
+# file cannot be relocated this way.
+def build_faststart_layout(path):
+    result = scan(path)
+    if not result.is_complete():
+        return None
+    ftyp, moov = result.find('ftyp'), result.find('moov')
+    if ftyp is None or ftyp.offset != 0 or moov is None:
+        return None
+
+    # Map the offset of every remaining box from the original file into the new file
+    rest, mapping = [box for box in result.boxes if box not in (ftyp, moov)], []
+    new_offset = ftyp.size + moov.size
+    for box in rest:
+        mapping.append((box.offset, box.end, new_offset))
+        new_offset += box.size
+
+    def remap(offset):
+        for old_start, old_end, new_start in mapping:
+            if old_start <= offset < old_end:
+                return new_start + (offset - old_start)
+        return None
+
+    fd = os.open(path, os.O_RDONLY)
+    try:
+        ftyp_data = os.pread(fd, ftyp.size, ftyp.offset)
+        moov_data = bytearray(os.pread(fd, moov.size, moov.offset))
+    finally:
+        os.close(fd)
+
+    for box in find_chunk_offset_boxes(moov_data, moov.header_size, len(moov_data)):
+        entry_format = '>I' if box.type == 'stco' else '>Q'
+        entry_size = struct.calcsize(entry_format)
+        _, num_entries = FULL_BOX_HEADER.unpack_from(moov_data, box.data_offset)
+        entries_offset = box.data_offset + FULL_BOX_HEADER.size
+        if entries_offset + num_entries * entry_size > box.end:
+            return None
+        for i in range(num_entries):
+            entry_offset = entries_offset + i * entry_size
+            chunk_offset, = struct.unpack_from(entry_format, moov_data, entry_offset)
+            chunk_offset = remap(chunk_offset)
+            if chunk_offset is None or (box.type == 'stco' and chunk_offset > MAX_32BIT_OFFSET):
+                return None
+            struct.pack_into(entry_format, moov_data, entry_offset, chunk_offset)
+
+    return ftyp_data + moov_data, [(box.offset, box.size) for box in rest]
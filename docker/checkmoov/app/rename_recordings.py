@@ -0,0 +1,98 @@
+#!/usr/bin/env python3
+import argparse
+import os
+import re
+import sys
+
+import config
+import mp4box
+import seekindex
+import segname
+
+#
+# Rename the numbered recordings of every camera (e.g. front_door_000123.mp4) to the
+# names used when segment_naming is "time" (e.g. front_door_20240101T130000Z.mp4) so
+# that existing recordings can be found by time in the same way as new ones.
+#
+# Capture must be stopped while recordings are renamed:
+#
+# docker-compose stop capture
+# docker-compose run --rm checkmoov python /app/rename_recordings.py /config/config.json
+#
+# Usage: rename_recordings.py [--dry-run] <config file>
+#
+
+MARKER_FILENAME = '.moov_check'  # Check marker written by checkmoov (holds the name of a recording)
+
+
+def get_numbered_recordings(cam_dir, cam_name):
+    regex = re.compile(rf'^{re.escape(cam_name)}_\d+\.mp4$')
+    files = [f for f in os.listdir(cam_dir) if regex.match(f)]
+    files.sort(key=lambda f: os.path.getmtime(os.path.join(cam_dir, f)))
+    return files
+
+
+def rename_camera(cam_dir, cam_name, dry_run):
+    num_renamed, num_skipped = 0, 0
+    previous_end = None  # Recordings follow on from one another
+    renamed = {}
+
+    for f in get_numbered_recordings(cam_dir, cam_name):
+        path = os.path.join(cam_dir, f)
+        end_time = os.path.getmtime(path)
+        duration = mp4box.get_duration(path)
+        start_time = end_time - duration if duration is not None else previous_end
+        previous_end = end_time
+
+        if start_time is None:
+            print(f'Skipping {f}: unable to determine its start time')
+            num_skipped += 1
+            continue
+        new_name = segname.get_filename(cam_name, start_time)
+        if os.path.exists(os.path.join(cam_dir, new_name)) or new_name in renamed.values():
+            print(f'Skipping {f}: {new_name} already exists')
+            num_skipped += 1
+            continue
+
+        print(f'{f} -> {new_name}')
+        renamed[f] = new_name
+        num_renamed += 1
+        if dry_run:
+            continue
+        os.rename(path, os.path.join(cam_dir, new_name))
+        sidecar_path = path + seekindex.SIDECAR_EXT
+        if os.path.exists(sidecar_path):
+            os.rename(sidecar_path, os.path.join(cam_dir, new_name + seekindex.SIDECAR_EXT))
+
+    # Keep checkmoov's place in the renamed recordings
+    marker_path = os.path.join(cam_dir, MARKER_FILENAME)
+    if not dry_run and os.path.exists(marker_path):
+        with open(marker_path) as marker:
+            marked = marker.read().strip()
+        if marked in renamed:
+            with open(marker_path, 'w') as marker:
+                marker.write(renamed[marked])
+
+    return num_renamed, num_skipped
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('config_file', help='CCTV JSON configuration file.')
+    parser.add_argument('-n', '--dry-run', action='store_true', help='Show what would be renamed.')
+    args = parser.parse_args()
+
+    try:
+        cfg = config.load(args.config_file)
+    except config.ConfigError as e:
+        sys.exit(f'Invalid configuration: {e}')
+
+    for cam in cfg.cameras:
+        if not os.path.isdir(cam.capture_path):
+            continue
+        num_renamed, num_skipped = rename_camera(cam.capture_path, cam.name, args.dry_run)
+        print(f'{cam.name}: {num_renamed} recordings renamed, {num_skipped} skipped')
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,256 @@
+import json
+import math
+import os
+import re
+from dataclasses import dataclass, field, fields, MISSING
+
+import segname
+
+#
+# The JSON configuration shared by all services, validated once when loaded into
+# frozen dataclasses with values derived from it (e.g. URLs and output paths)
+# precomputed. Keys used only by other services (e.g. the webserver) are ignored.
+#
+
+CAPTURE_MODE_SEPARATE = 'separate'  # Separate RTSP ingest for recording and for each live stream
+CAPTURE_MODE_COMBINED = 'combined'  # Single ingest of the first stream used for recording and live streaming
+CAPTURE_MODES         = (CAPTURE_MODE_SEPARATE, CAPTURE_MODE_COMBINED)
+
+RECORD_CONTAINER_MP4  = 'mp4'   # Classic MP4 (the moov atom is only written when the segment is closed)
+RECORD_CONTAINER_FMP4 = 'fmp4'  # Fragmented MP4 (playable up to the last fragment written if not closed)
+RECORD_CONTAINERS     = (RECORD_CONTAINER_MP4, RECORD_CONTAINER_FMP4)
+
+SEGMENT_NAMING_COUNTER = 'counter'  # Numbered by a counter that wraps at segment_wrap
+SEGMENT_NAMING_TIME    = 'time'     # Named by UTC start time (with segments starting on the clock)
+SEGMENT_NAMINGS        = (SEGMENT_NAMING_COUNTER, SEGMENT_NAMING_TIME)
+
+LIVE_STORAGE_DISK   = 'disk'    # Live output is written to the capture directory
+LIVE_STORAGE_MEMORY = 'memory'  # Live output is written to a memory backed directory (e.g. a tmpfs)
+LIVE_STORAGES       = (LIVE_STORAGE_DISK, LIVE_STORAGE_MEMORY)
+
+CHECK_MODE_POLL  = 'poll'   # Periodically sweep every camera directory for unchecked files
+CHECK_MODE_EVENT = 'event'  # Check each recording as soon as it is closed
+CHECK_MODES      = (CHECK_MODE_POLL, CHECK_MODE_EVENT)
+
+IO_PRIORITIES = ('realtime', 'best-effort', 'idle')
+
+LIVE_PLAYLIST_FILENAME       = 'live.m3u8'
+DEFAULT_SWEEP_MARGIN_PERCENT = 2  # Default target free disk space above the minimum
+
+
+class ConfigError(Exception):
+    pass
+
+
+# Field options: choices restricts the value to the given values, min_value sets a lower
+# bound and derived fields are not read from the JSON but set when the config is loaded
+def option(default=MISSING, choices=None, min_value=None, derived=False):
+    metadata = { 'choices' : choices, 'min_value' : min_value, 'derived' : derived }
+    return field(default=default, metadata=metadata)
+
+
+@dataclass(frozen=True, slots=True)
+class StreamConfig:
+    name:                    str
+    path:                    str
+    width:                   int   = option(None, min_value=1)
+    height:                  int   = option(None, min_value=1)
+    vtag:                    str   = None
+    aspect:                  str   = None
+    include_audio:           bool  = False
+    live_audio_advance_secs: float = None
+    xargs:                   tuple = option(())  # Extra ffmpeg arguments (split on whitespace)
+
+    url:                     str   = option(None, derived=True)
+    live_dir:                str   = option(None, derived=True)  # Relative to the capture directory
+    live_playlist:           str   = option(None, derived=True)
+
+
+@dataclass(frozen=True, slots=True)
+class CameraConfig:
+    name:               str
+    username:           str
+    password:           str
+    ip:                 str
+    port:               int   = option(min_value=1)
+    streams:            tuple = option()
+    onvif_port:         int   = option(None, min_value=1)
+    reboot_on_failure:  bool  = False
+    capture_mode:       str   = option(CAPTURE_MODE_SEPARATE, choices=CAPTURE_MODES)
+    record_container:   str   = option(RECORD_CONTAINER_MP4, choices=RECORD_CONTAINERS)
+    retention_weight:   float = option(1, min_value=0)
+    min_retention_days: float = option(0, min_value=0)
+
+    segment_naming:     str   = option(None, derived=True)  # Copied from the service configuration
+    capture_path:       str   = option(None, derived=True)  # Absolute path of the recordings directory
+    record_format:      str   = option(None, derived=True)  # Recording segment filename format
+    record_regex:       str   = option(None, derived=True)  # Pattern matching recording segment filenames
+
+
+@dataclass(frozen=True, slots=True)
+class Config:
+    root_path:                 str
+    capture_dir:               str
+    logs_dir:                  str
+    capture_log:               str
+    check_moov_log:            str
+    log_backup_count:          int   = option(min_value=0)
+    log_max_bytes:             int   = option(min_value=0)
+    segment_length:            int   = option(min_value=1)
+    segment_wrap:              int   = option(min_value=1)
+    health_poll_secs:          float = option(min_value=0)
+    time_must_be_dead_secs:    float = option(min_value=0)
+    min_free_disk_percent:     float = option(min_value=0)
+    onvif_wsdl_defs:           str   = option()
+    check_moov_interval_secs:  float = option(min_value=0)
+    cameras:                   tuple = option()
+
+    target_free_disk_percent:  float = option(None, min_value=0)  # Defaults to just above the minimum
+    segment_naming:            str   = option(SEGMENT_NAMING_COUNTER, choices=SEGMENT_NAMINGS)
+    sweep_ahead_secs:          float = option(300, min_value=0)
+    shutdown_timeout_secs:     float = option(8, min_value=0)  # Within Docker's default stop timeout
+    startup_batch_size:        int   = option(4, min_value=1)  # Streams started at once on startup
+    live_storage:              str   = option(LIVE_STORAGE_DISK, choices=LIVE_STORAGES)
+    live_memory_path:          str   = '/live'  # Memory backed directory used for live output
+    check_moov_workers:        int   = option(2, min_value=1)
+    check_moov_io_priority:    str   = option('idle', choices=IO_PRIORITIES)
+    check_moov_max_mb_per_sec: float = option(None, min_value=0)
+    check_moov_relocate_moov:  bool  = False
+    check_moov_mode:           str   = option(CHECK_MODE_POLL, choices=CHECK_MODES)
+    check_moov_seek_index:     bool  = False
+    check_moov_faststart_fmp4: bool  = False  # Convert closed fragmented recordings to faststart MP4
+    io_threads:                int   = option(None, min_value=1)
+    deletion_queue_size:       int   = option(None, min_value=1)
+    capture_status:            str   = 'capture_status.json'  # Status of every stream (in the logs directory)
+
+    capture_path:              str   = option(None, derived=True)
+    capture_log_file:          str   = option(None, derived=True)
+    check_moov_log_file:       str   = option(None, derived=True)
+    capture_status_file:       str   = option(None, derived=True)
+
+    def get_camera(self, name):
+        for cam in self.cameras:
+            if cam.name == name:
+                return cam
+        return None
+
+    def get_camera_names(self):
+        return [cam.name for cam in self.cameras]
+
+
+def load(config_file):
+    try:
+        with open(config_file) as json_config:
+            data = json.load(json_config)
+    except OSError as e:
+        raise ConfigError(f'Unable to open {config_file}: {e.strerror}')
+    except json.JSONDecodeError as e:
+        raise ConfigError(f'Invalid JSON in {config_file}: {e}')
+    return parse(data)
+
+
+def parse(data):
+    values = read_fields(Config, data, '')
+    capture_path = os.path.join(values['root_path'], values['capture_dir'])
+    logs_path = os.path.join(values['root_path'], values['logs_dir'])
+
+    if values['target_free_disk_percent'] is None:
+        values['target_free_disk_percent'] = values['min_free_disk_percent'] + DEFAULT_SWEEP_MARGIN_PERCENT
+
+    cameras = []
+    for i, cam_data in enumerate(read_list(data['cameras'], 'cameras', dict)):
+        cam = parse_camera(cam_data, f'cameras[{i}]', capture_path, values['segment_naming'], values['segment_wrap'])
+        if any(other.name == cam.name for other in cameras):
+            raise ConfigError(f'cameras[{i}].name: duplicate camera name "{cam.name}"')
+        cameras.append(cam)
+
+    return Config(**values,
+                  cameras=tuple(cameras),
+                  capture_path=capture_path,
+                  capture_log_file=os.path.join(logs_path, values['capture_log']),
+                  check_moov_log_file=os.path.join(logs_path, values['check_moov_log']),
+                  capture_status_file=os.path.join(logs_path, values['capture_status']))
+
+
+def parse_camera(data, path, capture_path, segment_naming, segment_wrap):
+    values = read_fields(CameraConfig, data, path)
+    name = values['name']
+
+    streams = []
+    for i, stream_data in enumerate(read_list(data['streams'], f'{path}.streams', dict)):
+        streams.append(parse_stream(stream_data, f'{path}.streams[{i}]', values))
+    if not streams:
+        raise ConfigError(f'{path}.streams: at least one stream is required')
+
+    if segment_naming == SEGMENT_NAMING_TIME:
+        record_format = f'{name}/{name}_{segname.TIME_FORMAT}.mp4'
+        record_regex = f'^{re.escape(name)}_{segname.TIME_PATTERN}\\.mp4$'
+    else:
+        num_digits = int(math.log10(segment_wrap)) + 1
+        record_format = f'{name}/{name}_%0{num_digits}d.mp4'
+        record_regex = f'^{re.escape(name)}_\\d+\\.mp4$'
+    return CameraConfig(**values,
+                        streams=tuple(streams),
+                        segment_naming=segment_naming,
+                        capture_path=os.path.join(capture_path, name),
+                        record_format=record_format,
+                        record_regex=record_regex)
+
+
+def parse_stream(data, path, cam_values):
+    values = read_fields(StreamConfig, data, path)
+    if 'xargs' in data:
+        values['xargs'] = tuple(read_value(data['xargs'], f'{path}.xargs', str).split())
+
+    live_dir = f'{cam_values["name"]}/{values["name"]}'
+    return StreamConfig(**values,
+                        url=f'rtsp://{cam_values["username"]}:{cam_values["password"]}@'
+                            f'{cam_values["ip"]}:{cam_values["port"]}{values["path"]}',
+                        live_dir=live_dir,
+                        live_playlist=f'{live_dir}/{LIVE_PLAYLIST_FILENAME}')
+
+
+# Read and validate the (non derived) scalar fields of the given dataclass from the given
+# JSON object. Lists are read separately (so are only checked for presence here).
+def read_fields(cls, data, path):
+    if not isinstance(data, dict):
+        raise ConfigError(f'{path or "config"}: expected an object')
+    values = {}
+    for f in fields(cls):
+        if f.metadata.get('derived'):
+            continue
+        field_path = f'{path}.{f.name}' if path else f.name
+        if f.name not in data:
+            if f.default is MISSING:
+                raise ConfigError(f'{field_path}: missing required field')
+            values[f.name] = f.default
+            continue
+        if f.type is tuple:
+            continue
+        value = read_value(data[f.name], field_path, f.type)
+        choices, min_value = f.metadata.get('choices'), f.metadata.get('min_value')
+        if choices is not None and value not in choices:
+            raise ConfigError(f'{field_path}: must be one of {", ".join(choices)} (not "{value}")')
+        if min_value is not None and value < min_value:
+            raise ConfigError(f'{field_path}: must be at least {min_value} (not {value})')
+        values[f.name] = value
+    return values
+
+
+def read_value(value, path, value_type):
+    # bool is a subclass of int so must not be accepted as a number
+    is_number = isinstance(value, (int, float)) and not isinstance(value, bool)
+    if value_type is float and is_number:
+        return value
+    if value_type is int and is_number and float(value).is_integer():
+        return int(value)
+    if value_type in (str, bool, dict) and type(value) is value_type:
+        return value
+    names = { str : 'a string', int : 'an integer', float : 'a number', bool : 'true or false', dict : 'an object' }
+    raise ConfigError(f'{path}: expected {names[value_type]} (not {json.dumps(value)})')
+
+
+def read_list(value, path, item_type):
+    if not isinstance(value, list):
+        raise ConfigError(f'{path}: expected a list')
+    return tuple(read_value(item, f'{path}[{i}]', item_type) for i, item in enumerate(value))
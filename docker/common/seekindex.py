@@ -0,0 +1,53 @@
+import os
+import struct
+
+#
+# Sidecar index written alongside each closed recording so that a playback time can
+# be mapped to the byte offset of the keyframe at or before it without opening the
+# recording. All values are little endian:
+#
+#   Header: magic, version, flags, recording size, start time (epoch secs), duration
+#           (secs), codec, width, height, bitrate (bits per sec), number of keyframes
+#   Entry:  keyframe time from the start of the recording (ms), byte offset
+#
+
+SIDECAR_EXT = '.idx'
+MAGIC       = b'SKIX'
+VERSION     = 1
+
+HEADER = struct.Struct('<4sHHQdd4sHHII')
+ENTRY  = struct.Struct('<IQ')
+
+
+class SeekIndex:
+    __slots__ = ('segment_size', 'start_time', 'duration', 'codec', 'width', 'height', 'bitrate', 'keyframes')
+
+    def __init__(self, segment_size, start_time, duration, codec, width, height, bitrate, keyframes):
+        self.segment_size = segment_size
+        self.start_time   = start_time
+        self.duration     = duration
+        self.codec        = codec
+        self.width        = width
+        self.height       = height
+        self.bitrate      = bitrate
+        self.keyframes    = keyframes  # List of (time ms, byte offset) in time order
+
+
+def get_path(segment_path):
+    return segment_path + SIDECAR_EXT
+
+
+def write(segment_path, index):
+    data = bytearray(HEADER.pack(MAGIC, VERSION, 0, index.segment_size, index.start_time, index.duration,
+                                 index.codec.encode('latin-1')[:4].ljust(4), index.width, index.height,
+                                 index.bitrate, len(index.keyframes)))
+    for time_ms, offset in index.keyframes:
+        data += ENTRY.pack(time_ms, offset)
+
+    # Write atomically so that a reader never sees a partial index
+    path = get_path(segment_path)
+    tmp_path = path + '.tmp'
+    with open(tmp_path, 'wb') as f:
+        f.write(data)
+    os.replace(tmp_path, path)
+
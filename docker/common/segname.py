@@ -0,0 +1,26 @@
+import calendar
+import re
+import time
+
+#
+# Names of recordings that start at a known (UTC) time, e.g. front_door_20240101T130000Z.mp4,
+# so that the recording holding any time can be found from the names alone. Names sort
+# in the order the recordings were made.
+#
+
+TIME_FORMAT  = '%Y%m%dT%H%M%SZ'  # Also used by ffmpeg (strftime) when naming recordings
+TIME_REGEX   = re.compile(r'^.*_(\d{4})(\d{2})(\d{2})T(\d{2})(\d{2})(\d{2})Z\.mp4$', re.IGNORECASE)
+TIME_PATTERN = r'\d{8}T\d{6}Z'   # Matches the time in a recording filename
+
+
+def get_filename(cam_name, start_time):
+    return f'{cam_name}_{time.strftime(TIME_FORMAT, time.gmtime(start_time))}.mp4'
+
+
+# Start time (epoch seconds) of a recording from its filename (or None if it is not named by time)
+def get_start_time(filename):
+    match = TIME_REGEX.match(filename)
+    if match is None:
+        return None
+    return calendar.timegm(tuple(int(group) for group in match.groups()))
+
@@ -18,7 +18,7 @@ const ensureLoggedIn = ensureLogIn();
 ///////////////////////////////////
 
 const EXCLUDED_FILES         = [ 'init.mp4', '.moov_check' ]; // Filenames to exclude in directory listings
-const EXCLUDED_EXTS          = [ '.m4s', '.css', '.json' ];   // Extentions of files to exclude in directory listings
+const EXCLUDED_EXTS          = [ '.m4s', '.css', '.json', '.idx' ]; // Extentions of files to exclude in directory listings
 
 const EXCLUDED_FILES_LOOKUP = {}, EXCLUDED_EXTS_LOOKUP = {};
 
@@ -97,8 +97,9 @@ router.get('/recordings', ensureLoggedIn, function(request, response, next) {
 
     utils.getFilesSortedByDate(cameraDir, 'mp4').forEach((entry) => {
         recordings.push([
-            entry[0],                        // Recording filename
-            Math.round(entry[1].birthtimeMs) // Recording creation time EPOC as UTC in milliseconds
+            entry[0], // Recording filename
+            // Recording start (or creation) time EPOC as UTC in milliseconds
+            utils.getRecordingStartTime(entry[0]) ?? Math.round(entry[1].birthtimeMs)
         ]);
     });
 
@@ -109,6 +110,24 @@ router.get('/recordings', ensureLoggedIn, function(request, response, next) {
     response.end(JSON.stringify(data));
 });
 
+router.get('/seek', ensureLoggedIn, async function(request, response, next) {
+    let camera = request.query.c;
+    let time   = parseInt(request.query.t, 10); // Epoch in milliseconds
+
+    if (!utils.isCameraNameValid(camera) || isNaN(time)) return response.sendStatus(404);
+
+    try {
+        let keyframe = await utils.findKeyframe(camera, time);
+        if (!keyframe) return response.sendStatus(404);
+
+        response.setHeader('Content-Type', 'application/json');
+        response.end(JSON.stringify(keyframe));
+    }
+    catch (err) {
+        next(err);
+    }
+});
+
 router.get('/kill_rec', ensureLoggedIn, async function(request, response, next) {
     try {
         const inCameras = [].concat(request.query.c || []);
@@ -120,28 +139,31 @@ router.get('/kill_rec', ensureLoggedIn, async function(request, response, next)
 
         if (cameras.length === 0) return response.sendStatus(404);
 
-        const initialRec = utils.getLatestRecordingFilename(cameras[0]);
-
-        await new Promise((resolve, reject) => {
+        // The reply has a line for each camera giving its status and the new recording
+        // started (or "-") and ends with an empty line
+        const reply = await new Promise((resolve, reject) => {
+            let data = '';
             const client = net.createConnection({ port: 6666, host: 'capture' })
-                .on('connect', () => { client.write(cameras.join(' ')); client.end(); })
+                .on('connect', () => client.write(cameras.join(' ') + '\n'))
+                .on('data', chunk => {
+                    data += chunk;
+                    if (data.endsWith('\n\n')) client.end();
+                })
                 .on('error', reject)
-                .on('close', resolve);
-            client.setTimeout(3000, () => { client.destroy(); reject(new Error('Timeout')); });
+                .on('close', () => resolve(data));
+            client.setTimeout(8000, () => { client.destroy(); reject(new Error('Timeout')); });
         });
 
-        // Wait for new recording to be triggered for the first camera
-        const maxAttempts = 20;
-        let newestRec = initialRec;
-
-        for (let i = 0; i < maxAttempts; i++) {
-            await new Promise(res => setTimeout(res, 200));
-            newestRec = utils.getLatestRecordingFilename(cameras[0]);
-
-            if (newestRec !== initialRec) {
-                return response.type('text/plain').send(newestRec);
-            }
+        // Reply with the new recording of the first camera
+        const results = new Map(reply.split('\n').filter(line => line).map(line => {
+            const [name, status, newRec] = line.split(' ');
+            return [name, { status: status, newRec: newRec }];
+        }));
+        const result = results.get(cameras[0]);
+        if (result && result.status === 'ok') {
+            return response.type('text/plain').send(result.newRec);
         }
+        logger.warn(`Kill recording of ${cameras[0]}: ${result ? result.status : 'no reply'}`);
 
         response.sendStatus(500);
     }
@@ -278,7 +300,7 @@ function getLocalPath(requestUrl) {
             break;
         }
     }
-    localPath = path.join(localPath, requestUrl);
+    localPath = path.join(localPath, inPath); // Excluding any query string
 
     return localPath;
 }
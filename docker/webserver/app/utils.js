@@ -2,6 +2,19 @@ const fs     = require('graceful-fs');
 const path   = require('path');
 const config = require('./config');
 
+// Keyframe index written alongside each recording (see docker/common/seekindex.py)
+const SEEK_INDEX_EXT         = '.idx';
+const SEEK_INDEX_MAGIC       = 'SKIX';
+const SEEK_INDEX_VERSION     = 1;
+const SEEK_INDEX_HEADER_SIZE = 48;
+const SEEK_INDEX_ENTRY_SIZE  = 12;
+
+// Camera name -> keyframe index headers of its recordings (see getSeekIndexes)
+const SEEK_INDEX_CACHE = {};
+
+// Recordings named by their UTC start time (see docker/common/segname.py)
+const RECORDING_TIME_REGEX = /^.*_(\d{4})(\d{2})(\d{2})T(\d{2})(\d{2})(\d{2})Z\.mp4$/i;
+
 module.exports = {
     sortFilesByName: function(fitems) {
         let sortedFiles = fitems.sort((a, b) => {
@@ -44,7 +57,7 @@ module.exports = {
 
     getTotalRecordTimeDays: function() {
         const cameras = config.get('cameras');
-        const regex = /.*_\d+\..*/; // Match only numbered recording files
+        const regex = /.*_(\d+|\d{8}T\d{6}Z)\..*/; // Match only numbered or time named recording files
 
         // Get the oldest recording timestamp across all cameras
         const oldestTimestamp = cameras.reduce((earliest, camera) => {
@@ -55,15 +68,16 @@ module.exports = {
             // Find the oldest file in the camera directory
             const oldestInCamera = fs.readdirSync(cameraPath)
                 .filter(name => regex.test(name))
-                .sort() // Alphabetical sort works for numbered recordings
+                .sort() // Alphabetical sort works for numbered and time named recordings
                 [0];    // Get the first (oldest) recording
 
             if (!oldestInCamera) return earliest;
 
-            const { ctimeMs } = fs.statSync(path.join(cameraPath, oldestInCamera));
+            const startMs = this.getRecordingStartTime(oldestInCamera) ??
+                            fs.statSync(path.join(cameraPath, oldestInCamera)).ctimeMs;
 
             // Return whichever time is older
-            return (earliest === 0 || ctimeMs < earliest) ? ctimeMs : earliest;
+            return (earliest === 0 || startMs < earliest) ? startMs : earliest;
         }, 0);
 
         if (oldestTimestamp === 0) return 0;
@@ -72,6 +86,14 @@ module.exports = {
         return ((Date.now() - oldestTimestamp) / msPerDay).toFixed(2);
     },
 
+    // Start time (epoch in milliseconds) of a recording named by its start time (otherwise null)
+    getRecordingStartTime: function(filename) {
+        const match = RECORDING_TIME_REGEX.exec(filename);
+        if (!match) return null;
+        const [year, month, day, hours, minutes, seconds] = match.slice(1).map(Number);
+        return Date.UTC(year, month - 1, day, hours, minutes, seconds);
+    },
+
     isCameraNameValid: function(cameraName) {
         let isValid = false;
         config.get('cameras').forEach((camera) => {
@@ -107,5 +129,140 @@ module.exports = {
                 }
             })
             .sort((a, b) => b.mtime - a.mtime)[0]?.file || null;
+    },
+
+    // Read the header of the keyframe index for a recording (or null if there is no current index)
+    readSeekIndexHeader: async function(recordingPath) {
+        let file;
+        try {
+            file = await fs.promises.open(recordingPath + SEEK_INDEX_EXT, 'r');
+            const buf = Buffer.alloc(SEEK_INDEX_HEADER_SIZE);
+            const { bytesRead } = await file.read(buf, 0, SEEK_INDEX_HEADER_SIZE, 0);
+            if (bytesRead < SEEK_INDEX_HEADER_SIZE) return null;
+
+            const header = {
+                magic        : buf.toString('latin1', 0, 4),
+                version      : buf.readUInt16LE(4),
+                size         : Number(buf.readBigUInt64LE(8)),
+                start        : buf.readDoubleLE(16) * 1000, // Epoch in milliseconds
+                duration     : buf.readDoubleLE(24),        // Seconds
+                codec        : buf.toString('latin1', 32, 36).trim(),
+                width        : buf.readUInt16LE(36),
+                height       : buf.readUInt16LE(38),
+                bitrate      : buf.readUInt32LE(40),
+                numKeyframes : buf.readUInt32LE(44)
+            };
+            if (header.magic !== SEEK_INDEX_MAGIC || header.version !== SEEK_INDEX_VERSION) return null;
+
+            return header;
+        } catch (e) {
+            return null;
+        } finally {
+            if (file !== undefined) await file.close();
+        }
+    },
+
+    // Keyframe index headers of the recordings of a camera sorted by start time. The directory
+    // is only read again when it changes (indexes and recordings are replaced by renaming them)
+    // and then only new or replaced indexes are read.
+    getSeekIndexes: async function(cameraName) {
+        const cameraDir = this.getCameraCaptureDir(cameraName);
+        const cache = SEEK_INDEX_CACHE[cameraName] ??
+            (SEEK_INDEX_CACHE[cameraName] = { dirMtimeMs: null, indexes: new Map(), sorted: [], refresh: null });
+
+        let dirStat;
+        try {
+            dirStat = await fs.promises.stat(cameraDir);
+        } catch (e) {
+            return [];
+        }
+        if (dirStat.mtimeMs === cache.dirMtimeMs) return cache.sorted;
+
+        // Requests arriving during a refresh wait for it rather than reading the directory again
+        if (!cache.refresh) {
+            cache.refresh = this.refreshSeekIndexes(cameraDir, cache, dirStat.mtimeMs)
+                .finally(() => { cache.refresh = null; });
+        }
+        await cache.refresh;
+        return cache.sorted;
+    },
+
+    refreshSeekIndexes: async function(cameraDir, cache, dirMtimeMs) {
+        const filenames = (await fs.promises.readdir(cameraDir)).filter(name => path.extname(name) === SEEK_INDEX_EXT);
+        const indexes = new Map();
+
+        await Promise.all(filenames.map(async (filename) => {
+            const recording = filename.slice(0, -SEEK_INDEX_EXT.length);
+            try {
+                const mtimeMs = (await fs.promises.stat(path.join(cameraDir, filename))).mtimeMs;
+                const cached = cache.indexes.get(recording);
+                if (cached && cached.mtimeMs === mtimeMs) {
+                    indexes.set(recording, cached);
+                    return;
+                }
+                const header = await this.readSeekIndexHeader(path.join(cameraDir, recording));
+                if (header) indexes.set(recording, { recording: recording, mtimeMs: mtimeMs, header: header });
+            } catch (e) {
+                // Deleted during the refresh
+            }
+        }));
+
+        cache.indexes    = indexes;
+        cache.sorted     = [...indexes.values()].sort((a, b) => a.header.start - b.header.start);
+        cache.dirMtimeMs = dirMtimeMs;
+    },
+
+    // Find the recording and the byte offset of the keyframe at or before the given time
+    findKeyframe: async function(cameraName, epochMs) {
+        const indexes = await this.getSeekIndexes(cameraName);
+
+        // Binary search for the last recording starting at or before the time
+        let lo = 0, hi = indexes.length;
+        while (lo < hi) {
+            const mid = Math.floor((lo + hi) / 2);
+            if (indexes[mid].header.start <= epochMs) lo = mid + 1; else hi = mid;
+        }
+        if (lo === 0) return null;
+
+        const { recording, header } = indexes[lo - 1];
+        if (epochMs >= header.start + header.duration * 1000 || header.numKeyframes === 0) return null;
+
+        const recordingPath = path.join(this.getCameraCaptureDir(cameraName), recording);
+        let file;
+        try {
+            // Recordings are also changed in place (e.g. an incomplete fragment removed)
+            if (header.size !== (await fs.promises.stat(recordingPath)).size) return null;
+
+            // Binary search the keyframe table (only reading the entries that are needed)
+            const offsetMs = epochMs - header.start;
+            const entry = Buffer.alloc(SEEK_INDEX_ENTRY_SIZE);
+            file = await fs.promises.open(recordingPath + SEEK_INDEX_EXT, 'r');
+            const readEntry = async (i) => {
+                await file.read(entry, 0, SEEK_INDEX_ENTRY_SIZE, SEEK_INDEX_HEADER_SIZE + i * SEEK_INDEX_ENTRY_SIZE);
+                return [entry.readUInt32LE(0), Number(entry.readBigUInt64LE(4))];
+            };
+            let lo = 0, hi = header.numKeyframes - 1;
+            while (lo < hi) {
+                const mid = Math.ceil((lo + hi) / 2);
+                if ((await readEntry(mid))[0] <= offsetMs) lo = mid; else hi = mid - 1;
+            }
+            const [timeMs, offset] = await readEntry(lo);
+
+            return {
+                recording : recording,
+                start     : Math.round(header.start),
+                time      : timeMs / 1000, // Keyframe time in seconds from the start of the recording
+                offset    : offset,        // Byte offset of the keyframe in the recording
+                duration  : header.duration,
+                codec     : header.codec,
+                width     : header.width,
+                height    : header.height,
+                bitrate   : header.bitrate
+            };
+        } catch (e) {
+            return null; // Deleted since the index was read
+        } finally {
+            if (file !== undefined) await file.close();
+        }
     }
 };